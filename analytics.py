@@ -0,0 +1,354 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each worker reads the sheet itself
+    fcntl = None
+
+from sheets import INTERACTIONS_HEADERS, get_interactions_worksheet, sheets_call
+from parsing import parse_amount
+from metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Seconds between passes over new UserInteractions rows; 0 disables the job
+ANALYTICS_INTERVAL = float(os.getenv('ANALYTICS_REFRESH_SECONDS', '600'))
+# Aggregates and checkpoint, shared by the workers on a host; empty keeps them in memory
+ANALYTICS_PATH = os.getenv('ANALYTICS_STATE_PATH', 'analytics_state.json')
+# Rows fetched per Sheets call while catching up
+BATCH_ROWS = int(os.getenv('ANALYTICS_BATCH_ROWS', '2000'))
+# Rows behind the checkpoint read again each pass, for statuses updated in place
+REVISIT_ROWS = int(os.getenv('ANALYTICS_REVISIT_ROWS', '500'))
+# Days of per-day row counts to keep
+KEEP_DAYS = int(os.getenv('ANALYTICS_KEEP_DAYS', '30'))
+STATE_FORMAT = 1
+
+# Conversation order of the statuses the bot writes; others sort after them
+FUNNEL = ('Searching', 'Property Selected', 'Visit Scheduled')
+VISIT_STATUS = 'Visit Scheduled'
+
+# Upper edges of the budget histogram, in rupees
+BUDGET_BUCKETS = (2500000, 5000000, 7500000, 10000000, 15000000, 20000000, 30000000, 50000000)
+
+WIDTH = len(INTERACTIONS_HEADERS)
+FIRST_DATA_ROW = 2
+
+
+def _rupees(amount: int) -> str:
+    return f"{amount / 10000000:g}Cr" if amount >= 10000000 else f"{amount / 100000:g}L"
+
+
+BUDGET_LABELS = ([f"up to {_rupees(BUDGET_BUCKETS[0])}"]
+                 + [f"{_rupees(low)}-{_rupees(high)}" for low, high in zip(BUDGET_BUCKETS, BUDGET_BUCKETS[1:])]
+                 + [f"over {_rupees(BUDGET_BUCKETS[-1])}"])
+
+
+def budget_label(value: Any) -> str:
+    """Histogram bucket for a Budget cell"""
+    amount = parse_amount(str(value)) if value not in (None, '') else 0
+    if not amount:
+        return 'unknown'
+    return BUDGET_LABELS[bisect_left(BUDGET_BUCKETS, amount)]
+
+
+def empty_state() -> Dict[str, Any]:
+    return {
+        'format': STATE_FORMAT,
+        'next_row': FIRST_DATA_ROW,  # first sheet row not consumed yet
+        'recent': {},                # row -> status for the rows inside the revisit window
+        'rows': 0,
+        'status': {},
+        'budgets': {},               # location -> budget bucket -> searches
+        'visits': {},                # property name -> visits scheduled
+        'daily': {},                 # YYYY-MM-DD -> rows
+        'updated_at': None,
+    }
+
+
+def apply_rows(state: Dict[str, Any], first_row: int, rows: List[List[Any]], revisit: int = REVISIT_ROWS):
+    """Fold sheet rows starting at ``first_row`` into ``state``.
+
+    Rows before the checkpoint were counted already; only a changed status
+    moves them between funnel stages. Rows from the checkpoint on are new.
+    """
+    next_row = state['next_row']
+    recent = state['recent']
+    status_counts = Counter(state['status'])
+    for row, cells in enumerate(rows, first_row):
+        if len(cells) < WIDTH:
+            cells = list(cells) + [''] * (WIDTH - len(cells))
+        timestamp, _, _, budget, location, selected, visit, status = cells[:WIDTH]
+        status = str(status).strip() or 'Unknown'
+
+        if row < next_row:
+            previous = recent.get(row)
+            if previous is not None and previous != status:
+                status_counts[previous] -= 1
+                status_counts[status] += 1
+                recent[row] = status
+            continue
+
+        recent[row] = status
+        status_counts[status] += 1
+        state['rows'] += 1
+        day = str(timestamp)[:10]
+        if day:
+            state['daily'][day] = state['daily'].get(day, 0) + 1
+        if status == VISIT_STATUS or visit:
+            name = str(selected).strip() or 'unknown'
+            state['visits'][name] = state['visits'].get(name, 0) + 1
+        else:
+            place = str(location).strip().lower() or 'unknown'
+            buckets = state['budgets'].setdefault(place, {})
+            label = budget_label(budget)
+            buckets[label] = buckets.get(label, 0) + 1
+
+    state['next_row'] = max(next_row, first_row + len(rows))
+    state['status'] = {status: count for status, count in status_counts.items() if count}
+    cutoff = state['next_row'] - revisit
+    state['recent'] = {row: status for row, status in recent.items() if row >= cutoff}
+    if len(state['daily']) > KEEP_DAYS:
+        state['daily'] = dict(sorted(state['daily'].items())[-KEEP_DAYS:])
+
+
+def read_state(path: str = ANALYTICS_PATH) -> Optional[Dict[str, Any]]:
+    """Read the aggregates written by the last pass, or None if missing or unusable"""
+    if not path:
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('format') != STATE_FORMAT:
+            logger.warning(f"Ignoring analytics state with unsupported format: {path}")
+            return None
+        # JSON object keys are strings
+        state['recent'] = {int(row): status for row, status in state['recent'].items()}
+        return state
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, AttributeError) as e:
+        logger.warning(f"Could not read analytics state: {str(e)}")
+        return None
+
+
+def write_state(state: Dict[str, Any], path: str = ANALYTICS_PATH):
+    """Atomically replace the local analytics state"""
+    if not path:
+        return
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write analytics state: {str(e)}")
+
+
+@contextmanager
+def _pass_lock(path: str):
+    """Let one worker per host read the sheet; yields False if another one is"""
+    if fcntl is None or not path:
+        yield True
+        return
+    with open(f"{path}.lock", 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class LeadAnalytics:
+    """Lead funnel, budgets by location and visits per property, built incrementally.
+
+    Each pass reads only the UserInteractions rows after the stored
+    checkpoint, plus a short window before it because the bot updates the
+    status of a lead's latest row in place. Aggregates and checkpoint are
+    kept in a small JSON file, so a restart resumes where the last pass
+    stopped and dashboards read ``/stats`` instead of the sheet.
+    """
+
+    def __init__(self, interval: float = ANALYTICS_INTERVAL, path: str = ANALYTICS_PATH,
+                 batch_rows: int = BATCH_ROWS, revisit_rows: int = REVISIT_ROWS, worksheet=None):
+        self.interval = interval
+        self.path = path
+        self.batch_rows = batch_rows
+        self.revisit_rows = revisit_rows
+        self._worksheet = worksheet
+        self.state = read_state(path) or empty_state()
+        self._loaded_mtime = self._mtime()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.path) if self.path else None
+        except OSError:
+            return None
+
+    def _reload(self):
+        """Pick up a pass written by another worker"""
+        mtime = self._mtime()
+        if mtime is None or mtime == self._loaded_mtime:
+            return
+        state = read_state(self.path)
+        if state is not None:
+            with self._lock:
+                self.state = state
+                self._loaded_mtime = mtime
+
+    def run_once(self) -> int:
+        """Consume the rows added since the checkpoint; returns how many were new"""
+        with _pass_lock(self.path) as owner:
+            self._reload()
+            if not owner:
+                return 0
+            worksheet = self._worksheet or get_interactions_worksheet()
+            if not worksheet:
+                raise RuntimeError("Could not open UserInteractions worksheet")
+
+            consumed = 0
+            while True:
+                next_row = self.state['next_row']
+                first = max(FIRST_DATA_ROW, next_row - self.revisit_rows)
+                last = next_row + self.batch_rows - 1
+                rows = sheets_call('analytics_rows', worksheet.get, f"A{first}:H{last}")
+                if len(rows) < next_row - first:
+                    # Fewer rows than already counted: the sheet was cleared or trimmed
+                    logger.warning(f"UserInteractions shrank below row {next_row}, rebuilding analytics")
+                    with self._lock:
+                        self.state = empty_state()
+                    continue
+
+                with self._lock:
+                    apply_rows(self.state, first, rows, self.revisit_rows)
+                    self.state['updated_at'] = time.time()
+                consumed += self.state['next_row'] - next_row
+                if len(rows) < last - first + 1:
+                    break
+
+            write_state(self.state, self.path)
+            self._loaded_mtime = self._mtime()
+        if consumed:
+            inc('bot_analytics_rows_total', consumed)
+            logger.info(f"Analytics consumed {consumed} new interaction rows")
+        return consumed
+
+    def summary(self) -> Dict[str, Any]:
+        """JSON-ready aggregates for the /stats route"""
+        self._reload()
+        with self._lock:
+            state = self.state
+            status = state['status']
+            funnel = {stage: status.get(stage, 0) for stage in FUNNEL}
+            funnel.update(sorted((stage, count) for stage, count in status.items() if stage not in funnel))
+            order = {label: idx for idx, label in enumerate(BUDGET_LABELS)}
+            return {
+                'rows': state['rows'],
+                'checkpoint_row': state['next_row'],
+                'updated_at': state['updated_at'],
+                'funnel': funnel,
+                'budgets_by_location': {
+                    location: dict(sorted(buckets.items(), key=lambda item: order.get(item[0], len(order))))
+                    for location, buckets in sorted(state['budgets'].items())
+                },
+                'visits_by_property': dict(sorted(state['visits'].items(), key=lambda item: (-item[1], item[0]))),
+                'rows_by_day': dict(sorted(state['daily'].items())),
+            }
+
+    def start(self):
+        """Start the background job in this process if it is not already running"""
+        if self.interval <= 0 or not os.getenv('GOOGLE_SHEET_ID'):
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='lead-analytics', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error updating lead analytics: {str(e)}")
+            time.sleep(self.interval)
+
+
+if __name__ == "__main__":
+    # Catch up on a 100k-row sheet, then time a pass that only has new rows to read
+    import random
+    import tempfile
+    from scheduler import scheduler
+
+    # Time the aggregation itself, not the wait for Sheets quota
+    scheduler.bucket.rate = 1e9
+
+    class FakeWorksheet:
+        def __init__(self):
+            self.rows = [list(INTERACTIONS_HEADERS)]
+            self.calls = self.cells_read = 0
+
+        def get(self, range_name):
+            start, end = (int(part[1:]) for part in range_name.split(':'))
+            values = [list(row) for row in self.rows[start - 1:end]]
+            self.calls += 1
+            self.cells_read += sum(len(row) for row in values)
+            return values
+
+    rng = random.Random(3)
+    places = ['powai', 'bandra west', 'baner', 'whitefield']
+    budgets = ['4000000', '8000000', '10000000', '15000000', '25000000', '']
+
+    def add_lead(sheet, day):
+        budget, place = rng.choice(budgets), rng.choice(places)
+        sheet.rows.append([f"2026-10-{day:02d} 10:00:00", f"+91{rng.randrange(10**9)}", '2 BHK',
+                           budget, place, '', '', 'Searching'])
+        if rng.random() < 0.4:
+            sheet.rows[-1][7] = 'Property Selected'
+            if rng.random() < 0.5:
+                sheet.rows.append(sheet.rows[-1][:5] + [f"Listing {rng.randrange(50)}",
+                                                        '2026-10-20 16:00', 'Visit Scheduled'])
+
+    sheet = FakeWorksheet()
+    while len(sheet.rows) <= 100000:
+        add_lead(sheet, rng.randint(1, 17))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'analytics.json')
+        analytics = LeadAnalytics(interval=0, path=path, worksheet=sheet)
+        started = time.perf_counter()
+        analytics.run_once()
+        print(f"catch-up   {len(sheet.rows) - 1:6d} rows in {time.perf_counter() - started:6.3f} s, "
+              f"{sheet.calls} Sheets calls, state file {os.path.getsize(path) / 1024:.1f} KB")
+
+        # A status updated in place behind the checkpoint, then 100 new leads
+        sheet.rows[-1][7] = 'Closed'
+        for _ in range(100):
+            add_lead(sheet, 18)
+        sheet.calls = sheet.cells_read = 0
+        started = time.perf_counter()
+        new = LeadAnalytics(interval=0, path=path, worksheet=sheet).run_once()
+        print(f"increment  {new:6d} rows in {time.perf_counter() - started:6.3f} s, {sheet.calls} Sheets call, "
+              f"{sheet.cells_read} of {sum(len(row) for row in sheet.rows)} cells read")
+
+        expected = LeadAnalytics(interval=0, path='', worksheet=sheet)
+        expected.run_once()
+        assert analytics.summary()['funnel'] == expected.summary()['funnel']
+        assert analytics.summary() == dict(expected.summary(), updated_at=analytics.summary()['updated_at'])
+        print(json.dumps(analytics.summary()['funnel']))
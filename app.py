@@ -1,9 +1,17 @@
+import gc
+import json
 import os
 import logging
-from datetime import datetime
-from flask import Flask, request, jsonify
-from twilio.twiml.messaging_response import MessagingResponse
-from sheets import get_property_data, format_property_data, store_user_interaction, update_user_interaction_status
+from flask import Flask, Response, request, jsonify
+from twiml import TwimlResponse
+from catalog import PropertyCatalog
+from analytics import LeadAnalytics
+from conversation import ERROR_REPLY, handle_message, new_session
+from session_store import create_session_store
+from idempotency import create_reply_cache
+from ratelimit import ALLOWED, create_sender_limiter
+from metrics import inc, render_prometheus, timed
+from logging_config import configure_logging
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -11,258 +19,123 @@ load_dotenv()
 
 app = Flask(__name__)
 
-# Enhanced Logging setup
-logging.basicConfig(
-    level=logging.DEBUG,  # Changed to DEBUG for more detailed logs
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Logging setup, see LOG_MODE / LOG_LEVEL / LOG_DEBUG_SAMPLE_RATE in logging_config.py
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize property data from Google Sheets
+# Initialize property data from the local snapshot or Google Sheets; refreshed in the background afterwards
+catalog = PropertyCatalog()
 try:
-    records = get_property_data()
-    if records:
-        PROPERTIES = format_property_data(records)
-        logger.info(f"Successfully loaded {len(PROPERTIES)} properties from Google Sheets")
-    else:
+    if not catalog.load():
         logger.warning("No records found in Google Sheets, using default data")
-        PROPERTIES = {
-            'property1': {
-                'name': 'Ocean View Apartment',
-                'price': 12000000,
-                'location': 'Bandra, Mumbai',
-                'bhk': 3,
-                'description': 'Luxurious sea-facing apartment',
-                'images': [
-                    'https://imgur.com/vFCCHtC',
-                    'https://imgur.com/ihW0dlY',
-                    'https://imgur.com/YGxOIlh'
-                ]
-            }
-        }
 except Exception as e:
     logger.error(f"Error loading properties from Google Sheets: {str(e)}")
-    PROPERTIES = {
-        'property1': {
-            'name': 'Ocean View Apartment',
-            'price': 12000000,
-            'location': 'Bandra, Mumbai',
-            'bhk': 3,
-            'description': 'Luxurious sea-facing apartment',
-            'images': [
-                'https://imgur.com/vFCCHtC',
-                'https://imgur.com/ihW0dlY',
-                'https://imgur.com/YGxOIlh'
-            ]
-        }
-    }
+logger.info(f"Serving {len(catalog.properties)} properties")
+
+# With gunicorn --preload the catalog above is built once in the master. Moving
+# it out of the collector's view keeps GC passes from writing to those pages, so
+# forked workers keep sharing them copy-on-write.
+gc.freeze()
+
+# Session data, kept per SESSION_BACKEND with idle expiry
+sessions = create_session_store()
+# Replies by MessageSid, so Twilio's retries do not run a message twice
+replies = create_reply_cache()
+# Per-sender message budget
+limiter = create_sender_limiter()
+# Lead funnel and budget aggregates, updated from new UserInteractions rows only
+analytics = LeadAnalytics()
 
-# Session data
-sessions = {}
-
-def debug_session(from_number: str, action: str):
-    """Debug helper to log session state"""
-    if from_number in sessions:
-        logger.debug(f"Session Debug - Number: {from_number}, Action: {action}")
-        logger.debug(f"Current State: {sessions[from_number]}")
-    else:
-        logger.debug(f"No session found for {from_number}")
+@app.route('/whatsapp', methods=['POST'])
+def whatsapp_bot():
+    with timed('bot_stage_seconds', stage='webhook'):
+        return _whatsapp_bot()
 
-def parse_indian_currency(amount_str: str) -> int:
-    """Parse Indian currency format (e.g., '1.5 Cr', '80 L', '2.5 Cr') to rupees"""
+def _whatsapp_bot():
+    message_sid = ''
+    claimed = False
     try:
-        # Remove spaces and convert to lowercase
-        amount_str = str(amount_str).lower().strip()
-        
-        # Remove '₹' symbol if present
-        amount_str = amount_str.replace('₹', '').strip()
-        
-        # Handle crore format (Cr)
-        if 'cr' in amount_str:
-            # Extract the number before 'cr'
-            number = float(amount_str.replace('cr', '').strip())
-            return int(number * 10000000)  # 1 crore = 10 million rupees
-            
-        # Handle lakhs format (L)
-        elif 'l' in amount_str:
-            # Extract the number before 'l'
-            number = float(amount_str.replace('l', '').strip())
-            return int(number * 100000)  # 1 lakh = 100,000 rupees
-            
-        # Handle direct number format
+        with timed('bot_stage_seconds', stage='parse'):
+            incoming_msg = request.form.get('Body', '').strip().lower()
+            from_number = request.form.get('From', '')
+            message_sid = request.form.get('MessageSid', '')
+
+        logger.debug("Received message: '%s' from %s", incoming_msg, from_number)
+
+        if message_sid:
+            claimed = replies.claim(message_sid)
+            if not claimed:
+                logger.info("Duplicate delivery of %s, replaying stored reply", message_sid)
+                return replies.wait_for_reply(message_sid)
+
+        # Only first deliveries spend the sender's budget; a rejection is stored like any reply
+        verdict = limiter.check(from_number)
+        if verdict != ALLOWED:
+            reply = limiter.reply(verdict)
         else:
-            # Remove commas and convert to integer
-            return int(float(amount_str.replace(',', '')))
-            
-    except (ValueError, AttributeError) as e:
-        logger.error(f"Error parsing amount: {str(e)}")
-        return 0
+            session = sessions.get(from_number)
+            if session is None:
+                logger.debug("Creating new session for %s", from_number)
+                session = new_session(from_number)
 
-def send_property_images(response, images):
-    """Send property images using Twilio's Media Message API"""
-    try:
-        if not images:
-            logger.warning("No images provided to send")
-            return False
-            
-        msg = response.message("📸 Property Images:")
-        for image_url in images[:10]:
-            logger.debug(f"Attempting to send image: {image_url}")
-            msg.media(image_url)
-        logger.info(f"Successfully sent {len(images[:10])} images")
-        return True
-    except Exception as e:
-        logger.error(f"Error sending images: {str(e)}")
-        return False
+            reply = handle_message(session, incoming_msg, catalog)
+            sessions.set(from_number, session)
 
-@app.route('/whatsapp', methods=['POST'])
-def whatsapp_bot():
+    except Exception as e:
+        inc('bot_messages_total', step='unknown', outcome='error')
+        logger.error("Unexpected error in whatsapp_bot: %s", e, exc_info=True)
+        response = TwimlResponse()
+        response.add(ERROR_REPLY)
+        reply = str(response)
+
+    if claimed:
+        replies.complete(message_sid, reply)
+    return reply
+
+@app.before_request
+def start_background_refresh():
+    # Started lazily so it runs in each worker process, not a pre-fork parent
+    catalog.start()
+    analytics.start()
+
+@app.route('/catalog/refresh', methods=['POST'])
+def refresh_catalog():
+    """Reload the property catalog now instead of waiting for the next refresh"""
+    token = os.environ.get('CATALOG_REFRESH_TOKEN')
+    if not token:
+        # Forced refreshes cost a full sheet read, so the endpoint stays closed until a token is set
+        return jsonify({'error': 'refresh endpoint disabled'}), 403
+    if request.headers.get('X-Refresh-Token') != token:
+        return jsonify({'error': 'unauthorized'}), 401
+
+    force = request.args.get('force', '').lower() in ('1', 'true', 'yes')
     try:
-        incoming_msg = request.form.get('Body', '').strip().lower()
-        from_number = request.form.get('From', '')
-        response = MessagingResponse()
-
-        logger.debug(f"Received message: '{incoming_msg}' from {from_number}")
-
-        if from_number not in sessions:
-            logger.debug(f"Creating new session for {from_number}")
-            sessions[from_number] = {'step': 'start', 'phone_number': from_number}
-
-        current_step = sessions[from_number]['step']
-        logger.info(f"Processing message - Number: {from_number}, Message: '{incoming_msg}', Current step: {current_step}")
-
-        debug_session(from_number, "before_processing")
-
-        # Handle back and start commands
-        if incoming_msg in ['back', 'start']:
-            logger.debug(f"Handling navigation command: {incoming_msg}")
-            if incoming_msg == 'start':
-                sessions[from_number] = {'step': 'start', 'phone_number': from_number}
-                logger.debug("Resetting session to start")
-            elif current_step == 'collecting_budget':
-                sessions[from_number]['step'] = 'collecting_info'
-            elif current_step == 'collecting_location':
-                sessions[from_number]['step'] = 'collecting_budget'
-            elif current_step == 'details':
-                sessions[from_number]['step'] = 'collecting_location'
-            elif current_step == 'visit':
-                sessions[from_number]['step'] = 'details'
-            
-            debug_session(from_number, "after_navigation")
-            return whatsapp_bot()
-
-        # Collecting user preferences
-        if current_step == 'collecting_info':
-            if 'bhk' in incoming_msg:
-                sessions[from_number]['property_type'] = incoming_msg
-                response.message("Great choice! What's your budget range? (e.g., '1cr', '50lakhs', '1.5cr')\n\nType 'back' to change property type\nType 'start' to begin again")
-                sessions[from_number]['step'] = 'collecting_budget'
-                return str(response)
-            response.message("Could you specify the property type? (e.g., '3BHK apartment')\n\nType 'start' to begin again")
-            return str(response)
-
-        # Collecting budget
-        if current_step == 'collecting_budget':
-            budget = parse_indian_currency(incoming_msg)
-            if budget > 0:
-                sessions[from_number]['budget'] = budget
-                response.message("Got it! Any preferred location?\n\nType 'back' to change budget\nType 'start' to begin again")
-                sessions[from_number]['step'] = 'collecting_location'
-                return str(response)
-            response.message("Please enter a valid budget amount (e.g., '1cr', '50lakhs', '1.5cr')\n\nType 'back' to change property type\nType 'start' to begin again")
-            return str(response)
-
-        # Collecting location
-        if current_step == 'collecting_location':
-            sessions[from_number]['location'] = incoming_msg
-            
-            # Store initial interaction data
-            store_user_interaction({
-                'phone_number': from_number,
-                'property_type': sessions[from_number].get('property_type', ''),
-                'budget': sessions[from_number].get('budget', ''),
-                'location': incoming_msg,
-                'status': 'Searching'
-            })
-            
-            response.message(f"Perfect! Let me show you some options in {incoming_msg} within your budget.")
-            
-            # Store property list in session for number-based selection
-            property_list = list(PROPERTIES.items())
-            sessions[from_number]['property_list'] = property_list
-            
-            # Listing matching properties with numbers
-            for idx, (prop_id, details) in enumerate(property_list, 1):
-                response.message(f"{idx}. 🏡 {details['name']}: ₹{details['price']:,} at {details['location']} ({details['bhk']} BHK)")
-            
-            response.message("Reply with the property number or name for more details.\n\nType 'back' to change location\nType 'start' to begin again")
-            sessions[from_number]['step'] = 'details'
-            return str(response)
-
-        # Displaying property details
-        if current_step == 'details':
-            property_list = sessions[from_number].get('property_list', [])
-            
-            # Try to find property by number
-            try:
-                property_idx = int(incoming_msg) - 1
-                if 0 <= property_idx < len(property_list):
-                    prop_id, details = property_list[property_idx]
-                else:
-                    raise ValueError("Invalid property number")
-            except ValueError:
-                # Try to find property by name
-                prop_id = None
-                for pid, d in PROPERTIES.items():
-                    if incoming_msg == d['name'].lower():
-                        prop_id = pid
-                        details = d
-                        break
-            
-            if prop_id and details:
-                # Update interaction with selected property
-                sessions[from_number]['selected_property'] = details['name']
-                update_user_interaction_status(from_number, 'Property Selected')
-                
-                response.message(f"Property: {details['name']}\nPrice: ₹{details['price']:,}\nLocation: {details['location']}\nDescription: {details['description']}")
-                send_property_images(response, details.get('images', []))
-                response.message("Do you want to schedule a visit? (e.g., 'Yes, tomorrow at 4 PM')\n\nType 'back' to see other properties\nType 'start' to begin again")
-                sessions[from_number]['step'] = 'visit'
-                return str(response)
-            
-            response.message("Sorry, I couldn't find that property. Please try again with the property number or name.\n\nType 'back' to see the property list\nType 'start' to begin again")
-            return str(response)
-
-        # Handling visit scheduling
-        if current_step == 'visit':
-            if 'yes' in incoming_msg:
-                # Extract date and time from message
-                visit_schedule = incoming_msg.replace('yes', '').strip()
-                
-                # Update interaction with visit schedule
-                store_user_interaction({
-                    'phone_number': from_number,
-                    'property_type': sessions[from_number].get('property_type', ''),
-                    'budget': sessions[from_number].get('budget', ''),
-                    'location': sessions[from_number].get('location', ''),
-                    'selected_property': sessions[from_number].get('selected_property', ''),
-                    'visit_schedule': visit_schedule,
-                    'status': 'Visit Scheduled'
-                })
-                
-                response.message(f"Great! I've scheduled your visit for {visit_schedule}. Our representative will contact you shortly to confirm.\n\nType 'start' to look for more properties.")
-                return str(response)
-
-        debug_session(from_number, "after_processing")
-        
-        response.message("Sorry, I didn't get that. Please try again.\n\nType 'back' to go back\nType 'start' to begin again")
-        return str(response)
-
+        refreshed = catalog.refresh(force=force, max_age=0)
     except Exception as e:
-        logger.error(f"Unexpected error in whatsapp_bot: {str(e)}", exc_info=True)
-        response = MessagingResponse()
-        response.message("Sorry, something went wrong. Please type 'start' to begin again.")
-        return str(response)
+        logger.error(f"Error refreshing catalog: {str(e)}")
+        return jsonify({'error': 'refresh failed'}), 500
+
+    return jsonify({
+        'refreshed': refreshed,
+        'version': catalog.state.version,
+        'properties': len(catalog.properties)
+    })
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Lead analytics aggregated from UserInteractions, without reading the sheet"""
+    token = os.environ.get('STATS_TOKEN')
+    if not token:
+        # Lead counts and budgets are business data, so the endpoint stays closed until a token is set
+        return jsonify({'error': 'stats endpoint disabled'}), 403
+    if request.headers.get('X-Stats-Token') != token:
+        return jsonify({'error': 'unauthorized'}), 401
+    # json.dumps keeps the funnel in conversation order; jsonify would sort it
+    return Response(json.dumps(analytics.summary(), ensure_ascii=False), mimetype='application/json')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/', methods=['GET'])
 def root():
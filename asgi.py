@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+from urllib.parse import parse_qs
+
+from twiml import TwimlResponse
+from app import analytics, catalog, limiter, replies, sessions
+from conversation import ERROR_REPLY, handle_message, new_session
+from session_store import MemorySessionStore
+from idempotency import EMPTY_REPLY, POLL_INTERVAL, REPLY_WAIT
+from ratelimit import ALLOWED
+from interaction_queue import shutdown_writer
+from metrics import inc, observe, render_prometheus, timed
+
+logger = logging.getLogger(__name__)
+
+# Threads available for blocking work (Sheets calls, shared session store)
+BLOCKING_WORKERS = int(os.getenv('ASGI_BLOCKING_WORKERS', '8'))
+# Largest request body accepted, Twilio webhooks are a few KB
+MAX_BODY_BYTES = 64 * 1024
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix='asgi-blocking')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the bounded executor without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+async def _session_call(func, *args):
+    # The in-process stores are dict lookups; anything else does I/O
+    if isinstance(sessions, MemorySessionStore):
+        return func(*args)
+    return await run_blocking(func, *args)
+
+
+async def _check_sender(from_number: str) -> str:
+    if isinstance(limiter.store, MemorySessionStore):
+        return limiter.check(from_number)
+    return await run_blocking(limiter.check, from_number)
+
+
+async def _wait_for_reply(message_sid: str) -> str:
+    deadline = time.monotonic() + REPLY_WAIT
+    while True:
+        reply = await _session_call(replies.reply, message_sid)
+        if reply is not None:
+            return reply
+        if time.monotonic() >= deadline:
+            logger.warning("Gave up waiting for reply to %s", message_sid)
+            return EMPTY_REPLY
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def _read_body(receive) -> Optional[bytes]:
+    """Request body, or None if it is larger than MAX_BODY_BYTES"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get('more_body'):
+            return body
+
+
+async def _respond(send, status: int, body: str, content_type: str):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body.encode('utf-8')})
+
+
+async def whatsapp_bot(scope, receive, send):
+    started = time.perf_counter()
+    message_sid = ''
+    claimed = False
+    try:
+        body = await _read_body(receive)
+        if body is None:
+            # A truncated form would parse as a different message, so refuse it
+            await _respond(send, 413, 'Request body too large', 'text/plain')
+            return
+        with timed('bot_stage_seconds', stage='parse'):
+            form = parse_qs(body.decode('utf-8'))
+            incoming_msg = form.get('Body', [''])[0].strip().lower()
+            from_number = form.get('From', [''])[0]
+            message_sid = form.get('MessageSid', [''])[0]
+
+        logger.debug("Received message: '%s' from %s", incoming_msg, from_number)
+
+        if message_sid:
+            claimed = await _session_call(replies.claim, message_sid)
+            if not claimed:
+                logger.info("Duplicate delivery of %s, replaying stored reply", message_sid)
+                reply = await _wait_for_reply(message_sid)
+                observe('bot_stage_seconds', time.perf_counter() - started, stage='webhook')
+                await _respond(send, 200, reply, 'text/xml; charset=utf-8')
+                return
+
+        # Only first deliveries spend the sender's budget; a rejection is stored like any reply
+        verdict = await _check_sender(from_number)
+        if verdict != ALLOWED:
+            reply = limiter.reply(verdict)
+        else:
+            session = await _session_call(sessions.get, from_number)
+            if session is None:
+                logger.debug("Creating new session for %s", from_number)
+                session = new_session(from_number)
+
+            reply = handle_message(session, incoming_msg, catalog)
+            await _session_call(sessions.set, from_number, session)
+
+    except Exception as e:
+        inc('bot_messages_total', step='unknown', outcome='error')
+        logger.error("Unexpected error in whatsapp_bot: %s", e, exc_info=True)
+        response = TwimlResponse()
+        response.add(ERROR_REPLY)
+        reply = str(response)
+
+    if claimed:
+        await _session_call(replies.complete, message_sid, reply)
+    observe('bot_stage_seconds', time.perf_counter() - started, stage='webhook')
+    await _respond(send, 200, reply, 'text/xml; charset=utf-8')
+
+
+async def refresh_catalog(scope, receive, send):
+    """Reload the property catalog now instead of waiting for the next refresh"""
+    token = os.environ.get('CATALOG_REFRESH_TOKEN')
+    if not token:
+        # Forced refreshes cost a full sheet read, so the endpoint stays closed until a token is set
+        await _respond(send, 403, json.dumps({'error': 'refresh endpoint disabled'}), 'application/json')
+        return
+    headers = dict(scope.get('headers', []))
+    if headers.get(b'x-refresh-token', b'').decode() != token:
+        await _respond(send, 401, json.dumps({'error': 'unauthorized'}), 'application/json')
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    force = query.get('force', [''])[0].lower() in ('1', 'true', 'yes')
+    try:
+        refreshed = await run_blocking(catalog.refresh, force=force, max_age=0)
+    except Exception as e:
+        logger.error(f"Error refreshing catalog: {str(e)}")
+        await _respond(send, 500, json.dumps({'error': 'refresh failed'}), 'application/json')
+        return
+
+    await _respond(send, 200, json.dumps({
+        'refreshed': refreshed,
+        'version': catalog.state.version,
+        'properties': len(catalog.properties)
+    }), 'application/json')
+
+
+async def stats(scope, receive, send):
+    """Lead analytics aggregated from UserInteractions, without reading the sheet"""
+    token = os.environ.get('STATS_TOKEN')
+    if not token:
+        # Lead counts and budgets are business data, so the endpoint stays closed until a token is set
+        await _respond(send, 403, json.dumps({'error': 'stats endpoint disabled'}), 'application/json')
+        return
+    headers = dict(scope.get('headers', []))
+    if headers.get(b'x-stats-token', b'').decode() != token:
+        await _respond(send, 401, json.dumps({'error': 'unauthorized'}), 'application/json')
+        return
+    await _respond(send, 200, json.dumps(analytics.summary(), ensure_ascii=False), 'application/json')
+
+
+async def metrics(scope, receive, send):
+    await _respond(send, 200, render_prometheus(), 'text/plain; version=0.0.4')
+
+
+async def root(scope, receive, send):
+    await _respond(send, 200, "WhatsApp Bot is running!", 'text/html; charset=utf-8')
+
+
+ROUTES = {
+    ('POST', '/whatsapp'): whatsapp_bot,
+    ('POST', '/catalog/refresh'): refresh_catalog,
+    ('GET', '/stats'): stats,
+    ('GET', '/metrics'): metrics,
+    ('GET', '/'): root,
+}
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            catalog.start()
+            analytics.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await run_blocking(shutdown_writer)
+            _executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI entry point: ``uvicorn asgi:application`` or gunicorn with UvicornWorker"""
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        status = 405 if any(path == scope['path'] for _, path in ROUTES) else 404
+        await _respond(send, status, 'Not Found' if status == 404 else 'Method Not Allowed', 'text/plain')
+        return
+    await handler(scope, receive, send)
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each worker fetches on its own
+    fcntl = None
+
+from catalog_sources import CatalogSource, create_catalog_source, normalize_listings, report_errors
+from search import PropertyIndex
+from media import resolve_catalog_media
+from listings import Catalog, Property
+from twiml import RenderCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background revision checks
+REFRESH_INTERVAL = float(os.getenv('CATALOG_REFRESH_SECONDS', '300'))
+# Local snapshot of the formatted catalog; set to an empty string to disable
+SNAPSHOT_PATH = os.getenv('CATALOG_SNAPSHOT_PATH', 'catalog_snapshot.json')
+SNAPSHOT_FORMAT = 4
+
+# Served when the sheet cannot be read and nothing has been loaded yet
+DEFAULT_PROPERTIES = {
+    1: Property(
+        1,
+        name='Ocean View Apartment',
+        price=12000000,
+        location='Bandra, Mumbai',
+        bhk=3,
+        description='Luxurious sea-facing apartment',
+        images=[
+            'https://i.imgur.com/vFCCHtC.jpg',
+            'https://i.imgur.com/ihW0dlY.jpg',
+            'https://i.imgur.com/YGxOIlh.jpg'
+        ]
+    )
+}
+
+
+class CatalogState:
+    """An immutable, fully built catalog generation, its search index and rendered replies"""
+
+    __slots__ = ('properties', 'index', 'version', 'revision', 'fetched_at', 'renders')
+
+    def __init__(self, properties: Catalog, version: int, revision: Optional[str],
+                 fetched_at: float = 0.0):
+        self.properties = properties
+        self.index = PropertyIndex(properties)
+        self.version = version
+        self.revision = revision
+        self.fetched_at = fetched_at
+        self.renders = RenderCache()
+
+
+@contextmanager
+def _snapshot_lock():
+    """Serialize catalog fetches across the worker processes on this host"""
+    if fcntl is None or not SNAPSHOT_PATH:
+        yield
+        return
+    with open(f"{SNAPSHOT_PATH}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_snapshot() -> Optional[Dict[str, Any]]:
+    """Read the local catalog snapshot, or None if it is missing or unusable"""
+    if not SNAPSHOT_PATH:
+        return None
+    try:
+        with open(SNAPSHOT_PATH, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if snapshot.get('format') != SNAPSHOT_FORMAT or not snapshot.get('properties'):
+            logger.warning(f"Ignoring catalog snapshot with unsupported format: {SNAPSHOT_PATH}")
+            return None
+        # The file's mtime is the last time any worker confirmed it against the sheet
+        snapshot['verified_at'] = os.path.getmtime(SNAPSHOT_PATH)
+        snapshot['properties'] = {row[0]: Property.from_row(row) for row in snapshot['properties']}
+        return snapshot
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError) as e:
+        logger.warning(f"Could not read catalog snapshot: {str(e)}")
+        return None
+
+
+def write_snapshot(state: CatalogState):
+    """Atomically replace the local catalog snapshot with the given catalog"""
+    if not SNAPSHOT_PATH:
+        return
+    snapshot = {
+        'format': SNAPSHOT_FORMAT,
+        'revision': state.revision,
+        'fetched_at': state.fetched_at,
+        'properties': [listing.to_row() for listing in state.properties.values()]
+    }
+    tmp_path = f"{SNAPSHOT_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, SNAPSHOT_PATH)
+    except OSError as e:
+        logger.warning(f"Could not write catalog snapshot: {str(e)}")
+
+
+class PropertyCatalog:
+    """Property catalog that refreshes itself in the background.
+
+    Each refresh builds a complete new ``CatalogState`` and swaps it in with a
+    single reference assignment, so a reader that grabs ``catalog.state`` once
+    per request always sees one consistent generation. Listings come from a
+    ``CatalogSource`` (Google Sheets unless CATALOG_SOURCE says otherwise) and
+    are only refetched when the source's revision has changed.
+
+    Every fetched catalog is also written to a local snapshot file. Starting
+    workers load that file instead of waiting on Sheets, and workers on the same
+    host take a file lock around refreshes so only one of them talks to Sheets
+    while the others pick up its snapshot.
+    """
+
+    def __init__(self, interval: float = REFRESH_INTERVAL, source: Optional[CatalogSource] = None):
+        self.interval = interval
+        self.source = source or create_catalog_source()
+        self.state = CatalogState(DEFAULT_PROPERTIES, 0, None)
+        self._refresh_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def properties(self) -> Catalog:
+        return self.state.properties
+
+    def load(self) -> bool:
+        """Load the catalog for a starting worker, from the local snapshot when there is one"""
+        snapshot = read_snapshot()
+        if snapshot:
+            self._swap(snapshot['properties'], snapshot['revision'], snapshot['fetched_at'])
+            logger.info(f"Loaded {len(self.properties)} properties from snapshot {SNAPSHOT_PATH}")
+            # The background thread revalidates it against the sheet
+            return True
+        return self.refresh()
+
+    def refresh(self, force: bool = False, max_age: Optional[float] = None) -> bool:
+        """Reload the catalog if the sheet changed; returns True if a new one was swapped in
+
+        A snapshot another worker confirmed less than ``max_age`` seconds ago
+        (default: the refresh interval) is used without asking Sheets. ``force``
+        refetches even when the revision is unchanged.
+        """
+        max_age = self.interval if max_age is None else max_age
+        with self._refresh_lock, _snapshot_lock():
+            snapshot = read_snapshot()
+            if not force and snapshot and time.time() - snapshot['verified_at'] < max_age:
+                if snapshot['fetched_at'] == self.state.fetched_at:
+                    return False
+                self._swap(snapshot['properties'], snapshot['revision'], snapshot['fetched_at'])
+                logger.info(f"Picked up catalog snapshot with {len(self.properties)} properties")
+                return True
+
+            revision = self.source.revision()
+            if not force and revision and revision == self.state.revision:
+                logger.debug(f"Catalog unchanged at revision {revision}")
+                if snapshot and snapshot['fetched_at'] == self.state.fetched_at:
+                    os.utime(SNAPSHOT_PATH)
+                else:
+                    write_snapshot(self.state)
+                return False
+
+            properties, errors = normalize_listings(self.source.fetch_columns())
+            report_errors(errors)
+            if not properties:
+                logger.warning("No properties loaded from the catalog source, keeping current catalog")
+                return False
+
+            # Only deliverable media reaches the snapshot and the webhooks
+            resolve_catalog_media(properties)
+            self._swap(properties, revision, time.time())
+            write_snapshot(self.state)
+            logger.info(f"Loaded catalog v{self.state.version} with {len(properties)} properties (revision {revision})")
+            return True
+
+    def _swap(self, properties: Catalog, revision: Optional[str], fetched_at: float):
+        self.state = CatalogState(properties, self.state.version + 1, revision, fetched_at)
+
+    def start(self):
+        """Start background refreshing in this process if it is not already running"""
+        if self.interval <= 0:
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='catalog-refresh', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error refreshing property catalog: {str(e)}")
+            time.sleep(self.interval)
@@ -0,0 +1,335 @@
+import csv
+import gc
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet exports need pyarrow; the other sources work without it
+    pq = None
+
+from sheets import get_catalog_revision, get_property_data
+from parsing import parse_amount
+from listings import Catalog, Property
+
+logger = logging.getLogger(__name__)
+
+# 'sheets' (default), or a file: 'csv:/data/listings.csv', 'jsonl:...', 'parquet:...'.
+# A bare path picks the format from its extension.
+CATALOG_SOURCE = os.getenv('CATALOG_SOURCE', 'sheets')
+
+# 'id' is optional; without it a listing's id is derived from its name and location
+FIELDS = ('id', 'name', 'price', 'location', 'bhk', 'description', 'images')
+
+Columns = Dict[str, List[Any]]
+
+
+@contextmanager
+def paused_gc():
+    """Skip cyclic GC passes while building 100k+ containers that are all kept"""
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+class CatalogSource:
+    """Where listings come from: a revision marker and the raw rows as columns"""
+
+    def revision(self) -> Optional[str]:
+        """Cheap change marker; None when unknown, which forces a fetch"""
+        return None
+
+    def fetch_columns(self) -> Columns:
+        """Raw listing fields by column name, one entry per row"""
+        raise NotImplementedError
+
+
+class SheetsSource(CatalogSource):
+    """The first worksheet of the property spreadsheet"""
+
+    def revision(self) -> Optional[str]:
+        return get_catalog_revision()
+
+    def fetch_columns(self) -> Columns:
+        records = get_property_data()
+        return {field: [record.get(field, '') for record in records] for field in FIELDS}
+
+
+class FileSource(CatalogSource):
+    """A local export; the file's size and mtime stand in for a revision"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def revision(self) -> Optional[str]:
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            logger.warning(f"Could not stat catalog file: {str(e)}")
+            return None
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class CsvSource(FileSource):
+    def fetch_columns(self) -> Columns:
+        with open(self.path, newline='', encoding='utf-8-sig') as f, paused_gc():
+            reader = csv.reader(f)
+            header = [name.strip().lower() for name in next(reader, [])]
+            rows = [row for row in reader if any(row)]
+        if not rows:
+            return {}
+        width = len(header)
+        # Pad short rows so every column has one value per row
+        columns = zip(*(row + [''] * (width - len(row)) if len(row) < width else row for row in rows))
+        return {name: list(values) for name, values in zip(header, columns) if name in FIELDS}
+
+
+class JsonlSource(FileSource):
+    def fetch_columns(self) -> Columns:
+        with open(self.path, encoding='utf-8') as f, paused_gc():
+            records = [json.loads(line) for line in f if line.strip()]
+        return {field: [record.get(field, '') for record in records] for field in FIELDS}
+
+
+class ParquetSource(FileSource):
+    def fetch_columns(self) -> Columns:
+        if pq is None:
+            raise RuntimeError("Reading Parquet catalogs requires pyarrow (pip install pyarrow)")
+        table = pq.read_table(self.path)
+        names = {name.strip().lower(): name for name in table.column_names}
+        return {field: table.column(names[field]).to_pylist() for field in FIELDS if field in names}
+
+
+FILE_SOURCES = {'csv': CsvSource, 'jsonl': JsonlSource, 'parquet': ParquetSource}
+
+
+def create_catalog_source(spec: str = CATALOG_SOURCE) -> CatalogSource:
+    """Build the catalog source described by CATALOG_SOURCE"""
+    if spec == 'sheets':
+        return SheetsSource()
+    kind, sep, path = spec.partition(':')
+    if not sep or kind not in FILE_SOURCES:
+        kind, path = os.path.splitext(spec)[1].lstrip('.').lower(), spec
+    if kind not in FILE_SOURCES:
+        logger.warning(f"Unknown CATALOG_SOURCE '{spec}', using Google Sheets")
+        return SheetsSource()
+    logger.info(f"Using {kind} catalog file {path}")
+    return FILE_SOURCES[kind](path)
+
+
+def _parse_prices(values: List[Any], errors: List[Tuple[int, str, Any]]) -> List[int]:
+    try:
+        # Plain integer columns (the common export) convert in one pass
+        return list(map(int, values))
+    except (TypeError, ValueError):
+        pass
+    prices = []
+    for row, value in enumerate(values, 1):
+        if type(value) is int:
+            prices.append(value)
+            continue
+        text = str(value).strip() if value is not None else ''
+        if text.isdigit():
+            prices.append(int(text))
+            continue
+        price = parse_amount(text)
+        if not price and text not in ('', '0'):
+            errors.append((row, 'price', value))
+        prices.append(price)
+    return prices
+
+
+def _parse_bhks(values: List[Any], errors: List[Tuple[int, str, Any]]) -> List[int]:
+    try:
+        return list(map(int, values))
+    except (TypeError, ValueError):
+        pass
+    bhks = []
+    for row, value in enumerate(values, 1):
+        if type(value) is int:
+            bhks.append(value)
+            continue
+        text = str(value).strip() if value is not None else ''
+        if text.isdigit():
+            bhks.append(int(text))
+            continue
+        try:
+            bhks.append(int(float(text.replace(',', ''))))
+        except ValueError:
+            errors.append((row, 'bhk', value))
+            bhks.append(0)
+    return bhks
+
+
+def _split_images(values: List[Any], errors: List[Tuple[int, str, Any]]) -> List[List[str]]:
+    images = []
+    for row, value in enumerate(values, 1):
+        if type(value) is str:
+            images.append(value.split(','))
+        elif isinstance(value, (list, tuple)):
+            images.append(list(value))
+        else:
+            # A number or object from a JSON file is not a list of URLs
+            if value:
+                errors.append((row, 'images', value))
+            images.append([])
+    return images
+
+
+def _text(values: List[Any], default: str) -> List[str]:
+    return [str(value) if value not in (None, '') else default for value in values]
+
+
+def _listing_ids(values: List[Any], names: List[str], locations: List[str],
+                 errors: List[Tuple[int, str, Any]]) -> List[int]:
+    """Ids that survive rows being inserted, deleted or sorted in the source
+
+    Sessions hold on to these between messages, across catalog refreshes. A
+    positive integer in the 'id' column is used as is; other listings get a
+    hash of their name and location, counting repeats of the same pair.
+    """
+    ids = []
+    used = set()
+    blake2b = hashlib.blake2b
+    for row, value, name, location in zip(range(1, len(names) + 1), values, names, locations):
+        if value not in ('', None):
+            text = str(value).strip()
+            if text.isdigit() and int(text) > 0 and int(text) not in used:
+                used.add(int(text))
+                ids.append(int(text))
+                continue
+            errors.append((row, 'id', value))
+        # 48 bits: collisions are negligible at catalog sizes and the ids stay small in sessions
+        key = f"{name}\x1f{location}"
+        listing_id = int.from_bytes(blake2b(key.encode(), digest_size=6).digest(), 'big')
+        repeat = 1
+        while listing_id in used:
+            # The same name and location again: number the repeats in row order
+            repeat += 1
+            listing_id = int.from_bytes(blake2b(f"{key}\x1f{repeat}".encode(), digest_size=6).digest(), 'big')
+        used.add(listing_id)
+        ids.append(listing_id)
+    return ids
+
+
+def normalize_listings(columns: Columns) -> Tuple[Catalog, List[Tuple[int, str, Any]]]:
+    """Turn raw columns into catalog listings, one column at a time.
+
+    Returns the listings keyed by their stable id and the (row, field, value)
+    of every value that could not be parsed. Such values fall back to 0, as
+    the per-row formatter used to do, so one bad cell never drops a listing.
+    """
+    with paused_gc():
+        return _normalize(columns)
+
+
+def _normalize(columns: Columns):
+    size = max((len(values) for values in columns.values()), default=0)
+    if not size:
+        return {}, []
+
+    def column(field):
+        values = columns.get(field)
+        return values if values is not None else [''] * size
+
+    errors: List[Tuple[int, str, Any]] = []
+    prices = _parse_prices(column('price'), errors)
+    bhks = _parse_bhks(column('bhk'), errors)
+    names = _text(column('name'), 'Unnamed Property')
+    locations = _text(column('location'), 'Location not specified')
+    rows = zip(
+        _listing_ids(column('id'), names, locations, errors),
+        names,
+        prices,
+        locations,
+        bhks,
+        _text(column('description'), 'No description available'),
+        _split_images(column('images'), errors),
+    )
+    listings = {row[0]: Property(*row) for row in rows}
+    return listings, errors
+
+
+def report_errors(errors: List[Tuple[int, str, Any]], examples: int = 5):
+    """Log validation errors as one summary instead of a line per row"""
+    if not errors:
+        return
+    by_field = Counter(field for _, field, _ in errors)
+    summary = ', '.join(f"{count} {field}" for field, count in by_field.most_common())
+    sample = '; '.join(f"row {row} {field}={value!r}" for row, field, value in errors[:examples])
+    logger.warning(f"Catalog has unparseable values ({summary}), e.g. {sample}")
+
+
+if __name__ == "__main__":
+    # Benchmark: ingest a 100k-listing export from each file format
+    import random
+    import tempfile
+
+    size = 100000
+    rng = random.Random(7)
+    areas = ['Bandra West, Mumbai', 'Powai, Mumbai', 'Baner, Pune', 'Whitefield, Bengaluru']
+    price_formats = [lambda p: str(p), lambda p: f"{p:,}", lambda p: f"{p / 10000000:.2f} Cr", lambda p: f"{p // 100000} L"]
+    records = [
+        {
+            'name': f'Listing {idx}',
+            'price': rng.choice(price_formats)(rng.randrange(20, 500) * 100000),
+            'location': rng.choice(areas),
+            'bhk': str(rng.randint(1, 5)),
+            'description': 'Sample listing',
+            'images': f'https://imgur.com/img{idx}a, https://imgur.com/img{idx}b'
+        }
+        for idx in range(size)
+    ]
+    records[10]['price'] = 'call for price'
+    records[20]['bhk'] = 'studio'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {'csv': os.path.join(tmp, 'listings.csv'), 'jsonl': os.path.join(tmp, 'listings.jsonl')}
+        with open(paths['csv'], 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+        with open(paths['jsonl'], 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+        if pq is not None:
+            import pyarrow as pa
+            paths['parquet'] = os.path.join(tmp, 'listings.parquet')
+            pq.write_table(pa.Table.from_pylist(records), paths['parquet'])
+        else:
+            print("pyarrow not installed, skipping Parquet")
+
+        for kind, path in paths.items():
+            parse_amount.cache_clear()
+            source = create_catalog_source(f"{kind}:{path}")
+            started = time.perf_counter()
+            columns = source.fetch_columns()
+            read = time.perf_counter() - started
+            listings, errors = normalize_listings(columns)
+            total = time.perf_counter() - started
+            assert len(listings) == size and len(errors) == 2, (len(listings), errors)
+            ordered = list(listings.values())
+            assert ordered[10].price == 0 and ordered[20].bhk == 0
+            print(f"{kind:8s} {size} listings: read {read * 1000:6.0f} ms, "
+                  f"normalize {(total - read) * 1000:5.0f} ms, total {total * 1000:6.0f} ms, {len(errors)} errors")
+        report_errors(errors)
+
+    # A JSON images cell that is not text or a list is reported, not fatal
+    listings, errors = normalize_listings({'price': [1, 2, 3], 'bhk': [1, 2, 3], 'images': ['x,y', ['z'], 5]})
+    assert [p.images for p in listings.values()] == [('x', 'y'), ('z',), ()] and errors == [(3, 'images', 5)]
+
+    # Ids follow the listing, not its row: inserting a row above keeps them, an id column wins
+    before, _ = normalize_listings({'name': ['a', 'b', 'b'], 'location': ['x', 'y', 'y']})
+    after, _ = normalize_listings({'name': ['new', 'a', 'b', 'b'], 'location': ['z', 'x', 'y', 'y']})
+    assert list(before) == list(after)[1:] and len(set(after)) == 4
+    listings, errors = normalize_listings({'id': ['7', '', 'x'], 'name': ['a', 'b', 'c'], 'bhk': [1, 2, 3]})
+    assert list(listings)[0] == 7 and errors == [(3, 'id', 'x')]
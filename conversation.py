@@ -0,0 +1,331 @@
+import logging
+import os
+import time
+
+from twiml import TwimlResponse, message
+from interaction_queue import enqueue_user_interaction, enqueue_status_update
+from metrics import inc, timed
+from parsing import parse_bhk, parse_budget, parse_visit_time, is_confirmation, is_refusal
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of listings kept for a search, and how many are sent per message
+SEARCH_RESULT_LIMIT = int(os.environ.get('SEARCH_RESULT_LIMIT', 50))
+PAGE_SIZE = int(os.environ.get('RESULTS_PAGE_SIZE', 5))
+# WhatsApp sends one attachment per message; cap the messages per listing
+MAX_IMAGES = 10
+
+# Static prompts, serialized to TwiML once
+WELCOME = message("👋 Welcome! What type of property are you looking for? (e.g., '3BHK apartment')\n\nType 'start' to begin again")
+ASK_TYPE = message("What type of property are you looking for? (e.g., '3BHK apartment')\n\nType 'start' to begin again")
+RETRY_TYPE = message("Could you specify the property type? (e.g., '3BHK apartment')\n\nType 'start' to begin again")
+ASK_BUDGET_AFTER_TYPE = message("Great choice! What's your budget range? (e.g., '1cr', '50lakhs', '1.5cr')\n\nType 'back' to change property type\nType 'start' to begin again")
+ASK_BUDGET = message("What's your budget range? (e.g., '1cr', '50lakhs', '1.5cr')\n\nType 'back' to change property type\nType 'start' to begin again")
+RETRY_BUDGET = message("Please enter a valid budget amount (e.g., '1cr', '50lakhs', '1.5cr')\n\nType 'back' to change property type\nType 'start' to begin again")
+ASK_LOCATION_AFTER_BUDGET = message("Got it! Any preferred location?\n\nType 'back' to change budget\nType 'start' to begin again")
+ASK_LOCATION = message("Any preferred location?\n\nType 'back' to change budget\nType 'start' to begin again")
+END_OF_RESULTS = message("That's all the matching properties.\n\nReply with a property number for details\nType 'back' to change location\nType 'start' to begin again")
+ASK_VISIT = message("Do you want to schedule a visit? (e.g., 'Yes, tomorrow at 4 PM')\n\nType 'back' to see other properties\nType 'start' to begin again")
+VISIT_DECLINED = message("No problem. Reply with a day and time whenever you'd like to visit.\n\nType 'back' to see other properties\nType 'start' to begin again")
+PROPERTY_NOT_FOUND = message("Sorry, I couldn't find that property. Please try again with the property number or name.\n\nType 'back' to see the property list\nType 'start' to begin again")
+ERROR_REPLY = message("Sorry, something went wrong. Please type 'start' to begin again.")
+NOT_UNDERSTOOD = message("Sorry, I didn't get that. Please try again.\n\nType 'back' to go back\nType 'start' to begin again")
+
+RESULTS_FOOTER = "Reply with the property number or name for more details.\n\nType 'back' to change location\nType 'start' to begin again"
+RESULTS_FOOTER_MORE = ("Reply with the property number or name for more details.\nType 'more' to see more ({remaining} left)"
+                       "\n\nType 'back' to change location\nType 'start' to begin again")
+
+def debug_session(session, action: str):
+    """Debug helper to log session state"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Session Debug - Number: %s, Action: %s", session.get('phone_number'), action)
+        logger.debug("Current State: %s", session)
+
+def new_session(phone_number: str):
+    """Return the state of a conversation that has not started yet"""
+    return {'step': 'start', 'phone_number': phone_number}
+
+def send_results_page(response, session, state):
+    """Send the page of search results at the session's offset as a single message
+
+    Pages are rendered once per catalog generation and reused (see twiml.py).
+    """
+    results = session.get('results', [])
+    offset = session.get('offset', 0)
+    if offset >= len(results):
+        response.add(END_OF_RESULTS)
+        return
+    response.add(state.renders.results_page(
+        state.properties, results, offset, PAGE_SIZE, RESULTS_FOOTER, RESULTS_FOOTER_MORE))
+
+def send_property_card(response, listing, state):
+    """Send a listing's details and its images using Twilio's Media Message API
+
+    The catalog only holds media that was validated at load time (see
+    media.py). WhatsApp takes one attachment per message, so each image gets
+    its own message.
+    """
+    response.add(state.renders.listing_card(listing, MAX_IMAGES))
+
+# Step handlers. Each one replies to a message received in its step and returns
+# True to move on to NEXT_STEP[step] or False to stay in the current step.
+
+def handle_start(session, incoming_msg, response, catalog) -> bool:
+    response.add(WELCOME)
+    return True
+
+def handle_collecting_info(session, incoming_msg, response, catalog) -> bool:
+    bhk = parse_bhk(incoming_msg)
+    if bhk or 'bhk' in incoming_msg:
+        session['property_type'] = incoming_msg
+        session['bhk'] = bhk
+        response.add(ASK_BUDGET_AFTER_TYPE)
+        return True
+    response.add(RETRY_TYPE)
+    return False
+
+def handle_collecting_budget(session, incoming_msg, response, catalog) -> bool:
+    budget = parse_budget(incoming_msg)
+    if budget:
+        session['budget_min'], session['budget_max'] = budget
+        session['budget'] = budget[1] or budget[0]
+        response.add(ASK_LOCATION_AFTER_BUDGET)
+        return True
+    response.add(RETRY_BUDGET)
+    return False
+
+def handle_collecting_location(session, incoming_msg, response, catalog) -> bool:
+    session['location'] = incoming_msg
+
+    # Store initial interaction data
+    enqueue_user_interaction({
+        'phone_number': session['phone_number'],
+        'property_type': session.get('property_type', ''),
+        'budget': session.get('budget', ''),
+        'location': incoming_msg,
+        'status': 'Searching'
+    })
+
+    # Rank matching listings instead of sending the whole catalog
+    state = catalog.state
+    with timed('bot_stage_seconds', stage='catalog_search'):
+        matches = state.index.search(
+            bhk=session.get('bhk'),
+            min_price=session.get('budget_min'),
+            max_price=session.get('budget_max'),
+            location=incoming_msg,
+            limit=SEARCH_RESULT_LIMIT
+        )
+    if not matches:
+        response.message(f"Sorry, I couldn't find any properties in {incoming_msg} within your budget. Try another location?\n\nType 'back' to change budget\nType 'start' to begin again")
+        return False
+
+    response.message(f"Perfect! Let me show you some options in {incoming_msg} within your budget.")
+
+    # Keep only the integer result IDs and a page offset in the session
+    session['results'] = matches
+    session['offset'] = 0
+    send_results_page(response, session, state)
+    return True
+
+def handle_details(session, incoming_msg, response, catalog) -> bool:
+    state = catalog.state
+    properties = state.properties
+    results = session.get('results', [])
+
+    if incoming_msg in ['more', 'next']:
+        offset = session.get('offset', 0) + PAGE_SIZE
+        session['offset'] = min(offset, len(results))
+        send_results_page(response, session, state)
+        return False
+
+    listing = None
+    with timed('bot_stage_seconds', stage='catalog_lookup'):
+        # Try to find property by number
+        try:
+            property_idx = int(incoming_msg) - 1
+            if 0 <= property_idx < len(results):
+                listing = properties.get(results[property_idx])
+        except ValueError:
+            # Try to find property by name among the listed results
+            for pid in results:
+                candidate = properties.get(pid)
+                if candidate and incoming_msg == candidate.name.lower():
+                    listing = candidate
+                    break
+
+    if listing:
+        # Update interaction with selected property
+        session['selected_property'] = listing.id
+        enqueue_status_update(session['phone_number'], 'Property Selected')
+
+        send_property_card(response, listing, state)
+        response.add(ASK_VISIT)
+        return True
+
+    response.add(PROPERTY_NOT_FOUND)
+    return False
+
+def handle_visit(session, incoming_msg, response, catalog) -> bool:
+    visit_time = parse_visit_time(incoming_msg)
+    if visit_time or is_confirmation(incoming_msg):
+        # Record a concrete date/time when the reply names one
+        if visit_time:
+            visit_schedule = visit_time.strftime('%Y-%m-%d %H:%M')
+            visit_display = visit_time.strftime('%a %d %b, %I:%M %p')
+        else:
+            visit_schedule = visit_display = 'a time to be confirmed'
+
+        # Update interaction with visit schedule
+        selected = catalog.properties.get(session.get('selected_property'))
+        enqueue_user_interaction({
+            'phone_number': session['phone_number'],
+            'property_type': session.get('property_type', ''),
+            'budget': session.get('budget', ''),
+            'location': session.get('location', ''),
+            'selected_property': selected.name if selected else '',
+            'visit_schedule': visit_schedule,
+            'status': 'Visit Scheduled'
+        })
+
+        response.message(f"Great! I've scheduled your visit for {visit_display}. Our representative will contact you shortly to confirm.\n\nType 'start' to look for more properties.")
+        return True
+
+    response.add(VISIT_DECLINED if is_refusal(incoming_msg) else NOT_UNDERSTOOD)
+    return False
+
+# Prompts sent when a step is re-entered with 'back'
+
+def prompt_collecting_info(session, response, catalog):
+    response.add(ASK_TYPE)
+
+def prompt_collecting_budget(session, response, catalog):
+    response.add(ASK_BUDGET)
+
+def prompt_collecting_location(session, response, catalog):
+    response.add(ASK_LOCATION)
+
+def prompt_details(session, response, catalog):
+    send_results_page(response, session, catalog.state)
+
+STEP_HANDLERS = {
+    'start': handle_start,
+    'collecting_info': handle_collecting_info,
+    'collecting_budget': handle_collecting_budget,
+    'collecting_location': handle_collecting_location,
+    'details': handle_details,
+    'visit': handle_visit,
+}
+
+# Where a step's handler leads when it returns True
+NEXT_STEP = {
+    'start': 'collecting_info',
+    'collecting_info': 'collecting_budget',
+    'collecting_budget': 'collecting_location',
+    'collecting_location': 'details',
+    'details': 'visit',
+    'visit': 'visit',
+}
+
+# Where 'back' leads from each step; steps not listed have nowhere to go back to
+BACK_EDGES = {
+    'collecting_budget': 'collecting_info',
+    'collecting_location': 'collecting_budget',
+    'details': 'collecting_location',
+    'visit': 'details',
+}
+
+STEP_PROMPTS = {
+    'collecting_info': prompt_collecting_info,
+    'collecting_budget': prompt_collecting_budget,
+    'collecting_location': prompt_collecting_location,
+    'details': prompt_details,
+}
+
+def handle_message(session, incoming_msg: str, catalog) -> str:
+    """Advance a conversation by one message and return the TwiML reply"""
+    from_number = session['phone_number']
+    response = TwimlResponse()
+
+    current_step = session['step']
+    logger.debug("Processing message - Number: %s, Message: '%s', Current step: %s", from_number, incoming_msg, current_step)
+
+    debug_session(session, "before_processing")
+
+    with timed('bot_stage_seconds', stage='dispatch'):
+        outcome = _dispatch(session, incoming_msg, response, catalog)
+    inc('bot_messages_total', step=current_step, outcome=outcome)
+
+    debug_session(session, "after_processing")
+    with timed('bot_stage_seconds', stage='twiml'):
+        return str(response)
+
+def _dispatch(session, incoming_msg, response, catalog) -> str:
+    """Run the command or step handler for a message; returns the outcome for metrics"""
+    current_step = session['step']
+    restarted = False
+
+    if incoming_msg == 'start':
+        logger.debug("Resetting session to start")
+        phone_number = session['phone_number']
+        session.clear()
+        session.update(new_session(phone_number))
+        current_step = 'start'
+        restarted = True
+    elif incoming_msg == 'back':
+        previous_step = BACK_EDGES.get(current_step)
+        if previous_step:
+            logger.debug("Going back from %s to %s", current_step, previous_step)
+            session['step'] = previous_step
+            STEP_PROMPTS[previous_step](session, response, catalog)
+            return 'back'
+
+    handler = STEP_HANDLERS.get(current_step)
+    if handler is None:
+        response.add(NOT_UNDERSTOOD)
+        return 'unknown_step'
+
+    advanced = handler(session, incoming_msg, response, catalog)
+    if advanced:
+        session['step'] = NEXT_STEP[current_step]
+    if restarted:
+        return 'restart'
+    return 'advanced' if advanced else 'stayed'
+
+if __name__ == "__main__":
+    # Microbenchmark: cost of each transition, including every back edge
+    from catalog import CatalogState, PropertyCatalog
+    from search import _synthetic_catalog
+
+    logging.disable(logging.CRITICAL)
+    catalog = PropertyCatalog(interval=0)
+    catalog.state = CatalogState(_synthetic_catalog(10000), 1, None)
+
+    script = [
+        ('start', 'hi', 'collecting_info'),
+        ('collecting_info', 'house', 'collecting_info'),
+        ('collecting_info', '3bhk', 'collecting_budget'),
+        ('collecting_budget', 'soon', 'collecting_budget'),
+        ('collecting_budget', '2cr', 'collecting_location'),
+        ('collecting_location', 'powai', 'details'),
+        ('details', 'more', 'details'),
+        ('details', '1', 'visit'),
+        ('visit', 'maybe', 'visit'),
+        ('visit', 'yes tomorrow at 4 pm', 'visit'),
+    ]
+    script += [(step, 'back', previous) for step, previous in BACK_EDGES.items()]
+    script += [(step, 'start', 'collecting_info') for step in STEP_HANDLERS]
+
+    session = new_session('whatsapp:+10000000000')
+    rounds = 2000
+    for step, message, expected in script:
+        base = dict(session, step=step, property_type='3bhk', bhk=3, budget=20000000, budget_max=20000000,
+                    results=[1, 2, 3], offset=0)
+        probe = dict(base)
+        handle_message(probe, message, catalog)
+        assert probe['step'] == expected, f"{step} + {message!r} -> {probe['step']}, expected {expected}"
+        started = time.perf_counter()
+        for _ in range(rounds):
+            handle_message(dict(base), message, catalog)
+        per_call = (time.perf_counter() - started) / rounds * 1e6
+        print(f"{per_call:8.1f} us  {step:20s} + {message!r:24s} -> {expected}")
@@ -0,0 +1,77 @@
+import logging
+import os
+import time
+from typing import Optional
+
+from twiml import TwimlResponse
+from session_store import SessionStore, create_session_store
+from metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# How long a reply is kept for redelivered webhooks; Twilio retries within minutes
+REPLY_TTL = float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '3600'))
+# How long a redelivery waits for the first delivery to finish before giving up
+REPLY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '10'))
+# A claim older than this belongs to a delivery that died; the next one takes over
+CLAIM_TIMEOUT = float(os.getenv('IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS', '60'))
+POLL_INTERVAL = 0.05
+
+# Sent to a redelivery whose original is still running: the original's reply is
+# what reaches the user, and an empty response stops Twilio retrying
+EMPTY_REPLY = str(TwimlResponse())
+
+
+class ReplyCache:
+    """Replies to recent webhooks, keyed on Twilio's MessageSid.
+
+    The first delivery of a message ``claim``s its MessageSid, runs the
+    handler and ``complete``s it with the TwiML it sent. A redelivery (Twilio
+    retrying after a timeout) finds the claim and gets the stored reply
+    instead of running the conversation and the Sheets writes a second time.
+
+    Replies live in a ``SessionStore``, so with SESSION_BACKEND=sqlite a retry
+    that lands on another worker is caught as well.
+    """
+
+    def __init__(self, store: SessionStore, claim_timeout: float = CLAIM_TIMEOUT):
+        self.store = store
+        self.claim_timeout = claim_timeout
+
+    def claim(self, message_sid: str) -> bool:
+        """Take ownership of a message; False if another delivery already has it"""
+        if self.store.add(message_sid, {'claimed_at': time.time()}):
+            return True
+        entry = self.store.get(message_sid)
+        if entry is None or (entry.get('reply') is None and time.time() - entry['claimed_at'] > self.claim_timeout):
+            logger.warning(f"Taking over stale claim on {message_sid}")
+            self.store.set(message_sid, {'claimed_at': time.time()})
+            return True
+        inc('bot_duplicate_deliveries_total')
+        return False
+
+    def complete(self, message_sid: str, reply: str):
+        """Store the reply sent for a claimed message"""
+        self.store.set(message_sid, {'claimed_at': time.time(), 'reply': reply})
+
+    def reply(self, message_sid: str) -> Optional[str]:
+        """The stored reply, or None while the first delivery is still running"""
+        entry = self.store.get(message_sid)
+        return entry.get('reply') if entry else None
+
+    def wait_for_reply(self, message_sid: str, timeout: float = REPLY_WAIT) -> str:
+        """Block until the first delivery's reply is stored, or return an empty reply"""
+        deadline = time.monotonic() + timeout
+        while True:
+            reply = self.reply(message_sid)
+            if reply is not None:
+                return reply
+            if time.monotonic() >= deadline:
+                logger.warning(f"Gave up waiting for reply to {message_sid}")
+                return EMPTY_REPLY
+            time.sleep(POLL_INTERVAL)
+
+
+def create_reply_cache() -> ReplyCache:
+    """Reply cache on the backend selected by SESSION_BACKEND"""
+    return ReplyCache(create_session_store(ttl=REPLY_TTL, table='replies'))
@@ -0,0 +1,380 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from sheets import (PHONE_COL, append_interaction_rows, build_interaction_row, find_interaction_rows,
+                    interaction_rows, last_interaction_row, write_interaction_statuses)
+from scheduler import is_ambiguous
+from metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Bounded in-memory queue; anything beyond this spills to disk
+QUEUE_SIZE = int(os.getenv('INTERACTION_QUEUE_SIZE', '1000'))
+# Flush once this many writes are pending...
+BATCH_SIZE = int(os.getenv('INTERACTION_BATCH_SIZE', '50'))
+# ...or once the oldest pending write is this many seconds old
+FLUSH_INTERVAL = float(os.getenv('INTERACTION_FLUSH_SECONDS', '2'))
+SPILL_PATH = os.getenv('INTERACTION_SPILL_PATH', 'interaction_spill.jsonl')
+# Seconds between attempts to move spilled writes back onto the queue
+SPILL_REPLAY_INTERVAL = float(os.getenv('INTERACTION_SPILL_REPLAY_SECONDS', '60'))
+
+_STOP = object()
+
+
+class InteractionWriter:
+    """Background writer that batches UserInteractions writes off the webhook path.
+
+    A flush costs at most three API calls however its writes interleave: one
+    read to find the rows of status updates for leads with no new row in the
+    batch, one ``append_rows`` for every new row, and one ``batch_update`` for
+    every status. A status update lands on the row most recently queued for
+    its phone number before it, or on the latest row in the sheet if there is
+    none. Transient API errors are retried by the Sheets scheduler; a batch
+    that still fails, or a write that finds the queue full, is spilled to a
+    local JSON-lines file and moved back onto the queue every
+    SPILL_REPLAY_INTERVAL seconds.
+
+    Appends are not retried blindly: when an append fails in a way that may
+    still have written the rows (a 5xx or a dropped connection), the spilled
+    rows remember where they could have landed, and the flush that replays
+    them first reads that part of the sheet and skips the ones it finds.
+    """
+
+    def __init__(self, queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, spill_path: str = SPILL_PATH,
+                 spill_replay_interval: float = SPILL_REPLAY_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.spill_replay_interval = spill_replay_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._spill_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._warned_no_sheet = False
+
+    def start(self):
+        """Start the writer thread in this process if it is not already running"""
+        with self._start_lock:
+            # Threads do not survive a fork, so gunicorn workers each start their own
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='interaction-writer', daemon=True)
+            self._thread.start()
+            logger.info("Started UserInteractions writer thread")
+
+    def enqueue_interaction(self, user_data: Dict[str, Any]) -> bool:
+        """Queue a new UserInteractions row; the timestamp is taken now"""
+        return self._put(['append', build_interaction_row(user_data)])
+
+    def enqueue_status(self, phone_number: str, status: str) -> bool:
+        """Queue a status update for the latest row of a phone number"""
+        return self._put(['status', phone_number, status])
+
+    def stop(self, timeout: float = 10.0):
+        """Flush pending writes and stop the writer thread"""
+        if not self._thread or not self._thread.is_alive() or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Writer queue full at shutdown, spilling pending writes")
+        self._thread.join(timeout)
+        # Anything still queued (thread stuck on a slow call) goes to disk
+        self._spill(self._drain())
+
+    def _put(self, item: List[Any]) -> bool:
+        if not os.getenv('GOOGLE_SHEET_ID'):
+            if not self._warned_no_sheet:
+                logger.error("No spreadsheet ID found in environment variables, interactions will not be stored")
+                self._warned_no_sheet = True
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            logger.warning("Interaction queue full, spilling write to disk")
+            self._spill([item])
+            return False
+
+    def _drain(self) -> List[List[Any]]:
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return items
+            if item is not _STOP:
+                items.append(item)
+
+    def _run(self):
+        pending: List[List[Any]] = []
+        deadline = None
+        # Writes spilled by a previous run are picked up as soon as the thread starts
+        next_replay = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= next_replay:
+                # Only with room to spare, so replayed writes do not spill again at once
+                if self._queue.qsize() < self._queue.maxsize // 2:
+                    try:
+                        self._replay_spill()
+                    except Exception as e:
+                        logger.error(f"Error replaying spilled interaction writes: {str(e)}")
+                next_replay = now + self.spill_replay_interval if self.spill_replay_interval > 0 else float('inf')
+            wake = next_replay if next_replay != float('inf') else None
+            if deadline is not None:
+                wake = deadline if wake is None else min(wake, deadline)
+            timeout = None if wake is None else max(0.0, wake - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._safe_flush(pending)
+                return
+            if item is not None:
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if pending and (len(pending) >= self.batch_size or time.monotonic() >= deadline):
+                # A flush costs the same few calls at any size, so take whatever else is waiting
+                stopping = False
+                while len(pending) < self.batch_size * 10:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    pending.append(item)
+                self._safe_flush(pending)
+                if stopping:
+                    return
+                pending = []
+                deadline = None
+
+    def _safe_flush(self, items: List[List[Any]]):
+        # A bug in one flush must not stop the thread or lose the batch
+        try:
+            self._flush(items)
+        except Exception as e:
+            logger.error(f"Unexpected error flushing interaction writes: {str(e)}", exc_info=True)
+            self._spill(items)
+
+    def _flush(self, items: List[List[Any]]):
+        """Apply queued writes: every append in one call, then every status in one call"""
+        items = self._skip_landed(items)
+        if items is None:
+            return
+        rows: List[List[Any]] = []
+        # (queued item, index into rows of the phone's last append before it, or None)
+        statuses = []
+        last_append: Dict[str, int] = {}
+        for item in items:
+            if item[0] == 'append':
+                last_append[item[1][PHONE_COL - 1]] = len(rows)
+                rows.append(item[1])
+            else:
+                # A spilled status update carries the row it was resolved to as a fourth item
+                statuses.append((item, None if len(item) > 3 else last_append.get(item[1])))
+
+        # Rows of leads with no new row in this batch, looked up before the append
+        lookup = {item[1] for item, position in statuses if position is None and len(item) < 4}
+        known: Optional[Dict[str, int]] = {}
+        if lookup:
+            known = self._apply(interaction_rows, lookup)
+            if known is False:
+                self._spill(items)
+                return
+
+        first_row = None
+        if rows:
+            try:
+                first_row = append_interaction_rows(rows)
+            except Exception as e:
+                logger.error(f"append_interaction_rows failed: {str(e)}")
+                if is_ambiguous(e):
+                    # The rows may be in the sheet anyway; the replay looks for them from here down
+                    start = last_interaction_row() + 1
+                    items = [item[:2] + [start] if item[0] == 'append' else item for item in items]
+                self._spill(items)
+                return
+        if first_row is None and any(position is not None for _, position in statuses):
+            # The append did not report its range; fall back to the index it updated
+            known = self._apply(interaction_rows, {item[1] for item, _ in statuses})
+            if known is False:
+                self._spill([item for item, _ in statuses])
+                return
+
+        targets: Dict[int, str] = {}
+        resolved = []
+        for item, position in statuses:
+            if len(item) > 3:
+                row = item[3]
+            elif position is not None and first_row is not None:
+                row = first_row + position
+            else:
+                row = known.get(item[1])
+            if row is None:
+                logger.warning(f"No interaction found for phone number {item[1]}")
+                continue
+            # Later updates to the same row win, as they would applied one by one
+            targets[row] = item[2]
+            resolved.append(['status', item[1], item[2], row])
+        if targets and self._apply(write_interaction_statuses, targets) is False:
+            self._spill(resolved)
+
+    def _skip_landed(self, items: List[List[Any]]) -> Optional[List[List[Any]]]:
+        """Drop replayed appends that an earlier, failed attempt wrote after all
+
+        Returns the writes still to apply, or None if they had to be spilled.
+        """
+        # An append from such an attempt carries the first row it could have landed on
+        uncertain = [item for item in items if item[0] == 'append' and len(item) > 2]
+        if not uncertain:
+            return items
+        found = self._apply(find_interaction_rows, [item[1] for item in uncertain],
+                            min(item[2] for item in uncertain))
+        if found is False:
+            self._spill(items)
+            return None
+        landed = {id(item) for item, present in zip(uncertain, found) if present}
+        if landed:
+            logger.info(f"Skipping {len(landed)} interaction rows already written by an earlier attempt")
+        return [item[:2] if item[0] == 'append' else item for item in items if id(item) not in landed]
+
+    def _apply(self, func, *args):
+        """Call ``func``, returning False if it raised"""
+        # Retries and backoff already happened in the scheduler
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.error(f"{func.__name__} failed: {str(e)}")
+            return False
+
+    def _spill(self, items: List[List[Any]]) -> bool:
+        """Append writes to the spill file; returns False if they could not be saved"""
+        if not items:
+            return True
+        try:
+            with self._spill_lock, open(self.spill_path, 'a', encoding='utf-8') as f:
+                for item in items:
+                    f.write(json.dumps(item, separators=(',', ':')) + '\n')
+            inc('bot_interaction_writes_spilled_total', len(items))
+            logger.warning(f"Spilled {len(items)} interaction writes to {self.spill_path}")
+            return True
+        except OSError as e:
+            logger.error(f"Could not spill interaction writes, {len(items)} lost: {str(e)}")
+            return False
+
+    def _replay_spill(self):
+        """Move spilled writes from a previous run back onto the queue
+
+        A line that is not a spilled write (a crash mid-write tears the last
+        one) is moved to a ``.bad`` file next to the spill. The replay file is only
+        removed once every item in it has been queued or spilled again, and
+        replay files left behind by a failed replay are picked up next time.
+        """
+        with self._spill_lock:
+            if os.path.exists(self.spill_path):
+                replay_path = f"{self.spill_path}.{os.getpid()}.replay"
+                try:
+                    os.replace(self.spill_path, replay_path)
+                except OSError:
+                    pass  # another worker picked it up
+            directory = os.path.dirname(self.spill_path) or '.'
+            prefix = os.path.basename(self.spill_path) + '.'
+            try:
+                # Only this process's files: another live worker may be replaying its own
+                replay_paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                                if name.startswith(prefix) and name.endswith('.replay')
+                                and not self._replay_in_use(name[len(prefix):-len('.replay')])]
+            except OSError:
+                return
+
+        for replay_path in replay_paths:
+            self._replay_file(replay_path)
+
+    def _replay_in_use(self, pid: str) -> bool:
+        """Whether another running process owns a replay file"""
+        if not pid.isdigit() or int(pid) == os.getpid():
+            return False
+        if os.name == 'nt':
+            return True  # signal 0 is CTRL_C_EVENT there, so it cannot be used as a probe
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass  # exists but belongs to someone else
+        return True
+
+    def _replay_file(self, replay_path: str):
+        items, bad = [], []
+        try:
+            with open(replay_path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        item = json.loads(line)
+                    except ValueError:
+                        item = None
+                    if isinstance(item, list) and item and item[0] in ('append', 'status'):
+                        items.append(item)
+                    else:
+                        bad.append(line if line.endswith('\n') else line + '\n')
+        except OSError as e:
+            logger.error(f"Could not read spilled interaction writes from {replay_path}: {str(e)}")
+            return
+        if bad:
+            try:
+                with self._spill_lock, open(f"{self.spill_path}.bad", 'a', encoding='utf-8') as f:
+                    f.writelines(bad)
+            except OSError as e:
+                logger.error(f"Could not set aside {len(bad)} unreadable spilled writes: {str(e)}")
+                return
+            logger.warning(f"Moved {len(bad)} unreadable spilled writes to {self.spill_path}.bad")
+
+        overflow = []
+        for item in items:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                overflow.append(item)
+        if not self._spill(overflow):
+            # Keep the file: what was queued may be replayed twice, which beats losing the rest
+            return
+        os.remove(replay_path)
+        logger.info(f"Replayed {len(items) - len(overflow)} spilled interaction writes")
+
+_writer = InteractionWriter()
+atexit.register(_writer.stop)
+
+
+def enqueue_user_interaction(user_data: Dict[str, Any]) -> bool:
+    """Queue a UserInteractions row without blocking on Sheets"""
+    return _writer.enqueue_interaction(user_data)
+
+
+def enqueue_status_update(phone_number: str, status: str) -> bool:
+    """Queue a UserInteractions status update without blocking on Sheets"""
+    return _writer.enqueue_status(phone_number, status)
+
+
+def shutdown_writer():
+    """Flush queued writes and stop the writer thread"""
+    _writer.stop()
@@ -0,0 +1,115 @@
+import sys
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+class Property:
+    """One catalog listing.
+
+    Slotted so a 100k-listing catalog costs a fraction of the per-listing
+    dicts it replaces. Locations are interned, so the thousands of listings
+    in one locality share a single string. Listings are built once per
+    catalog generation and never changed after it is swapped in, which is
+    what lets preloaded gunicorn workers share them copy-on-write.
+    """
+
+    __slots__ = ('id', 'name', 'price', 'location', 'bhk', 'description', 'images')
+
+    def __init__(self, id: int, name: str, price: int, location: str, bhk: int,
+                 description: str, images: Iterable[str] = ()):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.location = sys.intern(location)
+        self.bhk = bhk
+        self.description = description
+        self.images: Tuple[str, ...] = tuple(images)
+
+    def __repr__(self):
+        return f"Property({self.id}, {self.name!r}, {self.price}, {self.location!r}, {self.bhk})"
+
+    def to_row(self) -> List[Any]:
+        """Compact JSON form for the catalog snapshot"""
+        return [self.id, self.name, self.price, self.location, self.bhk, self.description, list(self.images)]
+
+    @classmethod
+    def from_row(cls, row: List[Any]) -> 'Property':
+        return cls(*row)
+
+
+Catalog = Dict[int, Property]
+
+
+if __name__ == "__main__":
+    # Memory of a 100k-listing catalog and of one session, dict layout vs. Property
+    import gc
+    import json
+    import os
+    import random
+    import tracemalloc
+
+    size = 100000
+    rng = random.Random(42)
+    localities = [f"{area}, {city}" for city in ('Mumbai', 'Pune', 'Bengaluru')
+                  for area in ('Bandra West', 'Powai', 'Andheri East', 'Baner', 'Whitefield', 'Kothrud')]
+    rows = [(idx, f'Listing {idx}', rng.randrange(20, 500) * 100000,
+             # Every row gets its own string, as when parsed from a file or API response
+             ''.join(list(rng.choice(localities))), rng.randint(1, 5), 'Sample listing',
+             [f'https://i.imgur.com/a{idx}.jpg', f'https://i.imgur.com/b{idx}.jpg'])
+            for idx in range(1, size + 1)]
+
+    def build_dicts():
+        return {f'property{r[0]}': {'name': r[1], 'price': r[2], 'location': r[3], 'bhk': r[4],
+                                    'description': r[5], 'images': list(r[6])} for r in rows}
+
+    def build_properties():
+        return {r[0]: Property(*r) for r in rows}
+
+    def measure(build):
+        gc.collect()
+        tracemalloc.start()
+        catalog = build()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return catalog, used
+
+    def private_dirty_kb(pid):
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            return sum(int(line.split()[1]) for line in f if line.startswith('Private_Dirty'))
+
+    def worker_growth(catalog):
+        """Private memory a forked worker dirties by searching the catalog once"""
+        gc.freeze()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            before = private_dirty_kb('self')
+            prices = [listing.price if isinstance(listing, Property) else listing['price']
+                      for listing in catalog.values()]
+            os.write(write_fd, str(private_dirty_kb('self') - before).encode())
+            os._exit(0 if prices else 1)
+        os.close(write_fd)
+        growth = int(os.read(read_fd, 32) or 0)
+        os.waitpid(pid, 0)
+        gc.unfreeze()
+        return growth
+
+    print(f"{size} listings")
+    for label, build in (('dict per listing', build_dicts), ('Property (slots)', build_properties)):
+        catalog, used = measure(build)
+        line = f"  {label:18s} {used / 2**20:6.1f} MB"
+        if os.path.exists('/proc/self/smaps_rollup') and hasattr(os, 'fork'):
+            line += f", forked worker dirties {worker_growth(catalog) / 1024:5.1f} MB reading every listing"
+        print(line)
+        del catalog
+
+    # A session used to carry the full (id, listing) pairs; it now keeps 50 ids and an offset
+    dicts = build_dicts()
+    old_session = {'step': 'details', 'properties': list(dicts.items())[:50]}
+    id_session = {'step': 'details', 'results': [f'property{idx}' for idx in range(1, 51)], 'offset': 0}
+    int_session = {'step': 'details', 'results': list(range(1, 51)), 'offset': 0}
+    # Catalog ids are 48-bit hashes of name and location (see catalog_sources.py)
+    hashed_session = {'step': 'details', 'results': [rng.getrandbits(48) for _ in range(50)], 'offset': 0}
+    for label, session in (('listing copies', old_session), ('string ids', id_session), ('integer ids', int_session),
+                           ('hashed ids', hashed_session)):
+        print(f"  session with {label:15s} {len(json.dumps(session, separators=(',', ':'))):6d} bytes serialized")
@@ -0,0 +1,400 @@
+"""Load test for the /whatsapp webhook in sync (Flask) and async (ASGI) mode.
+
+    python loadtest.py --mode both --conversations 200 --sheets-latency 0.3
+    python loadtest.py --save before.json             # on the old build
+    python loadtest.py --compare before.json          # on the new build
+
+Synthetic Twilio form posts for full conversations (greeting, BHK, budget,
+location, listing, visit) are replayed in-process. Sync mode pushes them
+through the Flask app from a fixed pool of threads, standing in for gunicorn
+sync workers. Async mode drives the ASGI application from one event loop.
+
+Nothing leaves the process. Google Sheets is replaced by a fake worksheet
+that sleeps ``--sheets-latency`` per call behind the real scheduler and
+interaction writer. The catalog comes from a fake source with the same
+latency, and image checks are off. ``--store-latency`` adds a blocking delay
+to every session store call to model a shared store reached over the network.
+
+Per-stage latencies come from the app's own ``bot_stage_seconds`` timings.
+``--save`` writes the results as JSON and ``--compare`` prints them next to a
+saved run, so two builds can be measured against each other.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from urllib.parse import urlencode
+
+from gspread.utils import a1_to_rowcol
+
+_tmp = tempfile.mkdtemp(prefix='loadtest-')
+os.environ.setdefault('CATALOG_SNAPSHOT_PATH', '')
+os.environ.setdefault('CATALOG_REFRESH_SECONDS', '0')
+os.environ.setdefault('ANALYTICS_REFRESH_SECONDS', '0')
+os.environ.setdefault('ANALYTICS_STATE_PATH', '')
+os.environ.setdefault('MEDIA_CHECK_WORKERS', '0')
+os.environ.setdefault('GOOGLE_SHEET_ID', 'loadtest')
+os.environ.setdefault('INTERACTION_SPILL_PATH', os.path.join(_tmp, 'spill.jsonl'))
+os.environ.setdefault('SHEETS_BUCKET_PATH', os.path.join(_tmp, 'sheets_bucket.state'))
+os.environ.setdefault('INTERACTION_INDEX_PATH', os.path.join(_tmp, 'interaction_index.db'))
+os.environ.setdefault('METRICS_DIR', '')
+logging.disable(logging.CRITICAL)
+
+import app as flask_app
+import asgi
+import metrics
+import sheets
+from catalog import PropertyCatalog
+from catalog_sources import CatalogSource
+from interaction_queue import shutdown_writer
+from search import _synthetic_catalog
+from session_store import SessionStore
+
+BHK_REPLIES = ['1bhk', '2 bhk flat', '3bhk', '3 bhk apartment', '4bhk', 'two bedroom flat']
+BUDGET_REPLIES = ['50 lakhs', '80l', '1cr', '1.5 cr', '2cr', '1-2 cr', 'under 3 crore']
+LOCATION_REPLIES = ['powai', 'bandra west', 'andheri', 'baner', 'whitefield', 'kondapur', 'anywhere']
+VISIT_REPLIES = ['yes tomorrow at 4 pm', 'yes', 'saturday 11am', 'ok monday at 6:30 pm']
+
+_sid = count(1)
+
+
+def conversation(rng: random.Random):
+    """One full conversation, start to visit, as the messages a user would send"""
+    return ['hi', rng.choice(BHK_REPLIES), rng.choice(BUDGET_REPLIES), rng.choice(LOCATION_REPLIES),
+            '1', rng.choice(VISIT_REPLIES)]
+
+
+def twilio_form(user: int, body: str):
+    """The fields Twilio posts for an inbound WhatsApp message"""
+    sid = f"SM{next(_sid):032x}"
+    return {
+        'MessageSid': sid,
+        'SmsMessageSid': sid,
+        'AccountSid': 'AC' + '0' * 32,
+        'From': f'whatsapp:+91{user:010d}',
+        'To': 'whatsapp:+14155238886',
+        'Body': body,
+        'NumMedia': '0',
+        'ProfileName': f'User {user}',
+        'WaId': f'91{user:010d}',
+    }
+
+
+class FakeWorksheet:
+    """Stands in for a gspread worksheet; every call sleeps like a Sheets round trip"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.rows = [list(sheets.INTERACTIONS_HEADERS)]
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+
+    def append_rows(self, rows):
+        self._call()
+        with self._lock:
+            first = len(self.rows) + 1
+            self.rows.extend(rows)
+        return {'updates': {'updatedRange': f"UserInteractions!A{first}:H{first + len(rows) - 1}"}}
+
+    def col_values(self, col):
+        self._call()
+        with self._lock:
+            return [row[col - 1] for row in self.rows]
+
+    def get(self, range_name):
+        # Open-ended single-column ranges, e.g. "B5:B"
+        self._call()
+        row, col = a1_to_rowcol(range_name.split(':')[0])
+        with self._lock:
+            return [[r[col - 1]] for r in self.rows[row - 1:]]
+
+    def update_cell(self, row, col, value):
+        self._call()
+        with self._lock:
+            self.rows[row - 1][col - 1] = value
+
+    def batch_update(self, data):
+        self._call()
+        with self._lock:
+            for update in data:
+                row, col = a1_to_rowcol(update['range'])
+                self.rows[row - 1][col - 1] = update['values'][0][0]
+
+
+class FakeCatalogSource(CatalogSource):
+    """Synthetic listings behind the same latency as the fake worksheet"""
+
+    def __init__(self, size: int, latency: float):
+        self.size = size
+        self.latency = latency
+
+    def revision(self):
+        time.sleep(self.latency)
+        return 'loadtest'
+
+    def fetch_columns(self):
+        time.sleep(self.latency)
+        listings = _synthetic_catalog(self.size).values()
+        return {
+            'name': [listing.name for listing in listings],
+            'price': [listing.price for listing in listings],
+            'location': [listing.location for listing in listings],
+            'bhk': [listing.bhk for listing in listings],
+            'description': [listing.description for listing in listings],
+            'images': [''] * self.size,
+        }
+
+
+class SlowSessionStore(SessionStore):
+    """Wraps a store and sleeps before every call, like a remote store would"""
+
+    def __init__(self, store: SessionStore, latency: float):
+        self.store = store
+        self.latency = latency
+
+    def get(self, key):
+        time.sleep(self.latency)
+        return self.store.get(key)
+
+    def set(self, key, value):
+        time.sleep(self.latency)
+        self.store.set(key, value)
+
+    def add(self, key, value):
+        time.sleep(self.latency)
+        return self.store.add(key, value)
+
+    def delete(self, key):
+        time.sleep(self.latency)
+        self.store.delete(key)
+
+
+class StageRecorder:
+    """Collects every ``bot_stage_seconds`` observation while installed"""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+        self._observe = metrics.observe
+
+    def observe(self, name, value, **labels):
+        self._observe(name, value, **labels)
+        if name == 'bot_stage_seconds':
+            with self._lock:
+                self.samples.setdefault(labels['stage'], []).append(value)
+
+    def __enter__(self):
+        metrics.observe = asgi.observe = self.observe
+        return self
+
+    def __exit__(self, *exc):
+        metrics.observe = asgi.observe = self._observe
+
+
+def rss_mb() -> float:
+    """Current resident set size; falls back to the peak where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies, elapsed=None):
+    summary = {
+        'count': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': statistics.mean(latencies) * 1000,
+    }
+    if elapsed:
+        summary['req_per_s'] = len(latencies) / elapsed
+    return summary
+
+
+def run_sync(conversations, workers, rng):
+    """Each conversation runs on one of ``workers`` threads, message by message"""
+    local = threading.local()
+    latencies = []
+    scripts = [conversation(rng) for _ in range(conversations)]
+
+    def converse(user):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = flask_app.app.test_client()
+        for message in scripts[user]:
+            started = time.perf_counter()
+            client.post('/whatsapp', data=twilio_form(user, message))
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(converse, range(conversations)))
+    return latencies, time.perf_counter() - started
+
+
+async def _asgi_post(path, form):
+    body = urlencode(form).encode()
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'POST', 'path': path, 'headers': [], 'query_string': b''}
+    await asgi.application(scope, receive, send)
+    return sent
+
+
+async def run_async(conversations, concurrency, rng):
+    """All conversations in flight at once, capped at ``concurrency``"""
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+    scripts = [conversation(rng) for _ in range(conversations)]
+
+    async def converse(user):
+        async with gate:
+            for message in scripts[user]:
+                started = time.perf_counter()
+                await _asgi_post('/whatsapp', twilio_form(1000000 + user, message))
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(converse(user) for user in range(conversations)))
+    return latencies, time.perf_counter() - started
+
+
+def run_mode(mode, args):
+    rng = random.Random(args.seed)
+    rss_before = rss_mb()
+    with StageRecorder() as recorder:
+        if mode == 'sync':
+            latencies, elapsed = run_sync(args.conversations, args.workers, rng)
+        else:
+            latencies, elapsed = asyncio.run(run_async(args.conversations, args.concurrency, rng))
+    result = summarize(latencies, elapsed)
+    result['stages'] = {stage: summarize(samples) for stage, samples in sorted(recorder.samples.items())}
+    result['rss_mb'] = rss_mb()
+    result['rss_growth_mb'] = result['rss_mb'] - rss_before
+    return result
+
+
+def print_result(mode, result):
+    print(f"{mode:6s} {result['count']:6d} req  {result['req_per_s']:9.1f} req/s  "
+          f"p50 {result['p50_ms']:7.2f} ms  p95 {result['p95_ms']:7.2f} ms  "
+          f"p99 {result['p99_ms']:7.2f} ms  mean {result['mean_ms']:7.2f} ms  "
+          f"rss {result['rss_mb']:6.1f} MB (+{result['rss_growth_mb']:.1f})")
+    for stage, stats in result['stages'].items():
+        print(f"  {stage:16s} {stats['count']:6d}    p50 {stats['p50_ms']:7.3f} ms  "
+              f"p95 {stats['p95_ms']:7.3f} ms  p99 {stats['p99_ms']:7.3f} ms")
+
+
+def print_comparison(baseline, current):
+    """Side-by-side of two saved runs; negative change is faster or smaller"""
+    def row(label, old, new):
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {label:28s} {old:10.3f} {new:10.3f} {change:+8.1f}%")
+
+    print(f"\n{baseline['label']} -> {current['label']}")
+    print(f"  {'':28s} {'before':>10s} {'after':>10s} {'change':>9s}")
+    row('catalog load_ms', baseline['catalog']['load_ms'], current['catalog']['load_ms'])
+    row('catalog rss_growth_mb', baseline['catalog']['rss_growth_mb'], current['catalog']['rss_growth_mb'])
+    for mode, new in current['modes'].items():
+        old = baseline['modes'].get(mode)
+        if not old:
+            continue
+        for key in ('req_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'rss_growth_mb'):
+            row(f"{mode} {key}", old[key], new[key])
+        for stage, stats in new['stages'].items():
+            if stage in old['stages']:
+                row(f"{mode} {stage} p95_ms", old['stages'][stage]['p95_ms'], stats['p95_ms'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=4, help='sync worker threads')
+    parser.add_argument('--concurrency', type=int, default=1000, help='async conversations in flight')
+    parser.add_argument('--store-latency', type=float, default=0.0, help='seconds added per session store call')
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help='seconds per fake Sheets call')
+    parser.add_argument('--catalog-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', help='name for this build in saved results')
+    parser.add_argument('--save', metavar='PATH', help='write results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='compare with results saved by --save')
+    args = parser.parse_args()
+
+    worksheet = FakeWorksheet(args.sheets_latency)
+    sheets.get_interactions_worksheet = lambda: worksheet
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    catalog = PropertyCatalog(interval=0, source=FakeCatalogSource(args.catalog_size, args.sheets_latency))
+    catalog.refresh(force=True)
+    results = {
+        'label': args.label or time.strftime('%Y-%m-%d %H:%M:%S'),
+        'args': vars(args),
+        'catalog': {'load_ms': (time.perf_counter() - started) * 1000, 'rss_growth_mb': rss_mb() - rss_before},
+        'modes': {},
+    }
+    flask_app.catalog.state = catalog.state
+    print(f"catalog {len(catalog.properties)} listings loaded in {results['catalog']['load_ms']:.0f} ms, "
+          f"+{results['catalog']['rss_growth_mb']:.1f} MB")
+
+    if args.store_latency:
+        slow = SlowSessionStore(flask_app.sessions, args.store_latency)
+        flask_app.sessions = asgi.sessions = slow
+
+    for mode in ('sync', 'async'):
+        if args.mode in (mode, 'both'):
+            results['modes'][mode] = run_mode(mode, args)
+            print_result(mode, results['modes'][mode])
+
+    # Whatever the writer cannot send before it stops is spilled, as in production
+    started = time.perf_counter()
+    shutdown_writer()
+    spill_path = os.environ['INTERACTION_SPILL_PATH']
+    spilled = sum(1 for _ in open(spill_path)) if os.path.exists(spill_path) else 0
+    shutil.rmtree(_tmp, ignore_errors=True)
+    results['sheets'] = {
+        'calls': worksheet.calls,
+        'rows_written': len(worksheet.rows) - 1,
+        'writes_spilled': spilled,
+        'drain_ms': (time.perf_counter() - started) * 1000,
+    }
+    print(f"sheets {worksheet.calls} calls, {results['sheets']['rows_written']} rows written, "
+          f"{spilled} writes spilled, writer drained in {results['sheets']['drain_ms']:.0f} ms")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved results to {args.save}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), results)
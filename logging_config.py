@@ -0,0 +1,170 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+DEV_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+# Queue and output of the production listener, read by the fork and exit hooks
+_listener_args = None
+_hooks_registered = False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """Keep every INFO+ record and a random share of DEBUG records"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that leaves JSON encoding to the listener thread.
+
+    ``msg % args`` is applied before the record is queued, since the arguments
+    may be live objects (a session dict) that the request goes on to change.
+    Tracebacks are rendered up front too, as they reference live frames.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def _start_listener(log_queue, handler):
+    global _listener, _listener_args
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener_args = (log_queue, handler)
+    _listener.start()
+
+
+def _stop_listener():
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_listener_in_child():
+    # The listener thread does not survive a fork (gunicorn --preload)
+    global _listener
+    if _listener_args:
+        _listener = None
+        _start_listener(*_listener_args)
+
+
+def configure_logging(mode: Optional[str] = None, level: Optional[str] = None,
+                      sample_rate: Optional[float] = None, stream=None):
+    """Configure the root logger once for the whole app.
+
+    Settings default to the environment: LOG_MODE ('dev' for readable
+    synchronous output, 'production' for JSON through a queue), LOG_LEVEL and
+    LOG_DEBUG_SAMPLE_RATE (share of DEBUG records kept; INFO and above are
+    never sampled).
+    """
+    global _hooks_registered, _listener_args
+    mode = mode or os.getenv('LOG_MODE', 'dev')
+    production = mode == 'production'
+    level = level or os.getenv('LOG_LEVEL', 'INFO' if production else 'DEBUG')
+    if sample_rate is None:
+        sample_rate = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01' if production else '1.0'))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    # A listener from an earlier call would keep its thread running
+    _stop_listener()
+    _listener_args = None
+    root.setLevel(level.upper())
+    stream = stream or sys.stderr
+
+    if not production:
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(DEV_FORMAT))
+        if sample_rate < 1.0:
+            handler.addFilter(DebugSampler(sample_rate))
+        root.addHandler(handler)
+        return
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler(sample_rate))
+    root.addHandler(queue_handler)
+
+    _start_listener(log_queue, output)
+    if not _hooks_registered:
+        # Registered once; the hooks act on whichever listener is current
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_restart_listener_in_child)
+        atexit.register(_stop_listener)
+        _hooks_registered = True
+
+
+if __name__ == "__main__":
+    # Benchmark: logging cost per webhook in dev vs. production mode
+    os.environ.setdefault('CATALOG_SNAPSHOT_PATH', '')
+    from catalog import CatalogState, PropertyCatalog
+    from conversation import handle_message, new_session
+    from search import _synthetic_catalog
+
+    catalog = PropertyCatalog(interval=0)
+    catalog.state = CatalogState(_synthetic_catalog(1000), 1, None)
+    conversation = ['hi', '3bhk', '2cr', 'powai', '1', 'yes tomorrow at 4 pm']
+    rounds = 300
+
+    def run():
+        started = time.perf_counter()
+        for user in range(rounds):
+            session = new_session(f'whatsapp:+9{user:09d}')
+            for message in conversation:
+                handle_message(session, message, catalog)
+        return (time.perf_counter() - started) / (rounds * len(conversation)) * 1e6
+
+    with open(os.devnull, 'w') as devnull:
+        logging.disable(logging.CRITICAL)
+        baseline = run()
+        logging.disable(logging.NOTSET)
+        results = []
+        for mode, level, rate in (('dev', 'DEBUG', 1.0), ('production', 'INFO', 0.01), ('production', 'DEBUG', 0.01)):
+            configure_logging(mode, level, rate, stream=devnull)
+            results.append((f"{mode} {level} sample={rate:g}", run()))
+            _stop_listener()
+
+    print(f"{'logging disabled':34s} {baseline:8.1f} us/request")
+    for label, cost in results:
+        print(f"{label:34s} {cost:8.1f} us/request  (+{cost - baseline:.1f} us for logging)")
@@ -0,0 +1,215 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import inc
+from listings import Catalog, Property
+
+logger = logging.getLogger(__name__)
+
+# Concurrent HEAD requests when validating a catalog; 0 skips validation
+CHECK_WORKERS = int(os.getenv('MEDIA_CHECK_WORKERS', '16'))
+CHECK_TIMEOUT = float(os.getenv('MEDIA_CHECK_TIMEOUT', '5'))
+# How long a validation result is trusted before the URL is checked again
+CACHE_TTL = float(os.getenv('MEDIA_CACHE_TTL_SECONDS', '86400'))
+# WhatsApp rejects images above 5 MB
+MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(5 * 1024 * 1024)))
+
+_IMGUR_PAGE_RE = re.compile(r'^https?://(?:www\.|m\.)?imgur\.com/([A-Za-z0-9]+)/?$')
+_DRIVE_FILE_RE = re.compile(r'^https?://drive\.google\.com/(?:file/d/|open\?id=)([\w-]+)')
+
+
+def normalize_image_url(url: str) -> Optional[str]:
+    """Turn a sheet value into a direct media URL, or None if it is not a URL
+
+    Imgur and Google Drive page links are rewritten to the URL of the file
+    itself, which is what Twilio needs to fetch.
+    """
+    url = url.strip()
+    if not url.startswith(('http://', 'https://')):
+        return None
+    match = _IMGUR_PAGE_RE.match(url)
+    if match:
+        return f"https://i.imgur.com/{match.group(1)}.jpg"
+    match = _DRIVE_FILE_RE.match(url)
+    if match:
+        return f"https://drive.google.com/uc?export=download&id={match.group(1)}"
+    return url
+
+
+class MediaValidator:
+    """Checks that image URLs are deliverable and remembers the answer.
+
+    A URL is deliverable when it answers with an ``image/*`` content type and
+    is no larger than ``MAX_BYTES``. Definite failures (4xx/5xx, wrong type,
+    too large) are cached like successes. Network errors are not cached and
+    the URL is kept, since Twilio may well reach a host that we cannot.
+    """
+
+    def __init__(self, workers: int = CHECK_WORKERS, timeout: float = CHECK_TIMEOUT,
+                 ttl: float = CACHE_TTL, max_bytes: int = MAX_BYTES):
+        self.workers = workers
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._cache: Dict[str, Tuple[bool, float]] = {}
+        self._lock = threading.Lock()
+        self.reset_connections()
+
+    def reset_connections(self):
+        """Start a fresh connection pool, e.g. in a worker forked from a preloaded parent"""
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max(1, self.workers), pool_maxsize=max(1, self.workers))
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def check(self, url: str) -> Optional[bool]:
+        """Ask the host about one URL; None when it could not be reached"""
+        try:
+            res = self._session.head(url, allow_redirects=True, timeout=self.timeout)
+            if res.status_code in (403, 405, 501):
+                # Some hosts refuse HEAD; the headers of a streamed GET are enough
+                res = self._session.get(url, allow_redirects=True, timeout=self.timeout, stream=True)
+                res.close()
+        except requests.RequestException as e:
+            logger.warning(f"Could not check image {url}: {str(e)}")
+            return None
+
+        content_type = res.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        size = res.headers.get('Content-Length')
+        if res.status_code >= 400:
+            reason = f"HTTP {res.status_code}"
+        elif not content_type.startswith('image/'):
+            reason = f"content type {content_type or 'missing'}"
+        elif size and size.isdigit() and int(size) > self.max_bytes:
+            reason = f"{int(size)} bytes"
+        else:
+            return True
+        logger.warning(f"Dropping image {url}: {reason}")
+        return False
+
+    def validate(self, urls: List[str]) -> Dict[str, bool]:
+        """Return url -> deliverable, checking uncached URLs concurrently"""
+        now = time.time()
+        results: Dict[str, bool] = {}
+        pending = []
+        with self._lock:
+            for url in set(urls):
+                cached = self._cache.get(url)
+                if cached and now - cached[1] < self.ttl:
+                    results[url] = cached[0]
+                else:
+                    pending.append(url)
+        if not pending:
+            return results
+
+        if self.workers <= 0:
+            results.update((url, True) for url in pending)
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(pending)),
+                                thread_name_prefix='media-check') as pool:
+            checked = list(pool.map(self.check, pending))
+        with self._lock:
+            for url, ok in zip(pending, checked):
+                results[url] = ok is not False
+                if ok is not None:
+                    self._cache[url] = (ok, now)
+        inc('bot_media_checks_total', len(pending))
+        inc('bot_media_rejected_total', checked.count(False))
+        return results
+
+
+def resolve_catalog_media(properties: Catalog, validator: Optional[MediaValidator] = None) -> Catalog:
+    """Replace each listing's images with normalized, validated media URLs"""
+    validator = validator or _validator
+    normalized = {}
+    for prop_id, listing in properties.items():
+        urls = (normalize_image_url(url) for url in listing.images)
+        normalized[prop_id] = list(dict.fromkeys(url for url in urls if url))
+
+    started = time.perf_counter()
+    deliverable = validator.validate([url for urls in normalized.values() for url in urls])
+    for prop_id, urls in normalized.items():
+        properties[prop_id].images = tuple(url for url in urls if deliverable.get(url))
+    logger.info(f"Validated {len(deliverable)} image URLs in {time.perf_counter() - started:.2f}s")
+    return properties
+
+
+_validator = MediaValidator()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_validator.reset_connections)
+
+
+if __name__ == "__main__":
+    # Self-check against a local HTTP stand-in for the image hosts
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class ImageHost(BaseHTTPRequestHandler):
+        responses = {
+            '/ok.jpg': (200, 'image/jpeg', 1024),
+            '/page': (200, 'text/html', 2048),
+            '/huge.png': (200, 'image/png', 10 * 1024 * 1024),
+            '/missing.jpg': (404, 'text/html', 0),
+        }
+
+        def do_HEAD(self):
+            time.sleep(0.05)
+            path = self.path.split('?')[0]
+            if path == '/no-head.jpg':
+                self.send_response(405)
+                self.end_headers()
+                return
+            status, content_type, size = self.responses.get(path, (404, 'text/html', 0))
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', '4')
+            self.end_headers()
+            self.wfile.write(b'\xff\xd8\xff\xd9')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ImageHost)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    assert normalize_image_url(' https://imgur.com/vFCCHtC ') == 'https://i.imgur.com/vFCCHtC.jpg'
+    assert normalize_image_url('https://drive.google.com/file/d/abc-1/view?usp=sharing') == \
+        'https://drive.google.com/uc?export=download&id=abc-1'
+    assert normalize_image_url('not a url') is None
+
+    properties = {
+        i: Property(i, f'Listing {i}', 0, '', 0, '', [f" {base}/ok.jpg?{i}", f"{base}/page", f"{base}/huge.png",
+                                                      f"{base}/missing.jpg", f"{base}/no-head.jpg?{i}", ''])
+        for i in range(50)
+    }
+    validator = MediaValidator(workers=16)
+    started = time.perf_counter()
+    resolve_catalog_media(properties, validator)
+    cold = time.perf_counter() - started
+    for listing in properties.values():
+        assert [url.rsplit('/', 1)[1].split('?')[0] for url in listing.images] == ['ok.jpg', 'no-head.jpg'], listing.images
+
+    started = time.perf_counter()
+    resolve_catalog_media(properties, validator)
+    warm = time.perf_counter() - started
+
+    unreachable = MediaValidator(workers=2, timeout=0.5)
+    assert unreachable.validate(['http://127.0.0.1:9/x.jpg']) == {'http://127.0.0.1:9/x.jpg': True}
+    server.shutdown()
+    print(f"{len(properties) * 2 + 3} URLs: cold {cold * 1000:.0f} ms with 16 workers "
+          f"(~{(len(properties) * 2 + 3) * 50} ms serially), warm {warm * 1000:.2f} ms from cache")
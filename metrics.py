@@ -0,0 +1,292 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no gunicorn workers to aggregate, each process reports itself
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Directory where each worker process publishes its metrics, so a scrape of any
+# worker reports the whole host; set to an empty string to report per process
+METRICS_DIR = os.getenv('METRICS_DIR', 'metrics_state')
+# Seconds between publishes, i.e. how far behind a scrape may see the other workers
+PUBLISH_INTERVAL = float(os.getenv('METRICS_PUBLISH_SECONDS', '5'))
+
+# Latency buckets in seconds, from sub-millisecond dispatch to slow Sheets calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    'bot_stage_seconds': 'Time spent in each stage of webhook handling',
+    'bot_messages_total': 'Messages handled, by conversation step and outcome',
+    'bot_duplicate_deliveries_total': 'Webhook redeliveries answered from the reply cache',
+    'bot_rate_limited_total': 'Messages rejected by the per-sender rate limit, by whether the sender was told',
+    'bot_sheets_call_seconds': 'Duration of Google Sheets API calls',
+    'bot_sheets_errors_total': 'Google Sheets API calls that raised',
+    'bot_sheets_retries_total': 'Google Sheets API calls retried after a 429, 5xx or connection error',
+    'bot_sheets_dropped_total': 'Google Sheets API calls that failed after every retry',
+    'bot_sheets_coalesced_total': 'Google Sheets reads served by an identical call already in flight',
+    'bot_sheets_throttled_seconds_total': 'Time callers waited for the Sheets rate limiter',
+    'bot_media_checks_total': 'Image URLs checked against their host',
+    'bot_media_rejected_total': 'Image URLs dropped as not deliverable',
+    'bot_interaction_writes_spilled_total': 'Interaction writes spilled to disk instead of Sheets',
+    'bot_analytics_rows_total': 'UserInteractions rows consumed by the lead analytics job',
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[LabelKey, float]] = {}
+# name -> labels -> [bucket counts..., +Inf count, sum]
+_histograms: Dict[str, Dict[LabelKey, List[float]]] = {}
+
+
+def _key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, amount: float = 1, **labels):
+    """Add to a counter"""
+    key = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels):
+    """Record one value in a histogram"""
+    key = _key(labels)
+    slot = bisect_left(BUCKETS, value)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * (len(BUCKETS) + 2)
+        counts[slot] += 1
+        counts[-1] += value
+
+
+@contextmanager
+def timed(name: str, **labels):
+    """Time the enclosed block into a histogram, whether or not it raises"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+Series = Tuple[Dict[str, Dict[LabelKey, float]], Dict[str, Dict[LabelKey, List[float]]]]
+
+
+def _copy() -> Series:
+    with _lock:
+        return ({name: dict(series) for name, series in _counters.items()},
+                {name: {key: list(counts) for key, counts in series.items()}
+                 for name, series in _histograms.items()})
+
+
+def _dump(path: str, metrics: Series):
+    counters, histograms = metrics
+    data = {
+        'counters': {name: [[key, value] for key, value in series.items()] for name, series in counters.items()},
+        'histograms': {name: [[key, counts] for key, counts in series.items()]
+                       for name, series in histograms.items()},
+    }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def _load_into(total: Series, path: str):
+    """Add the metrics saved in a file to ``total``"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable metrics file {path}: {str(e)}")
+        return
+    counters, histograms = total
+    for name, series in data.get('counters', {}).items():
+        merged = counters.setdefault(name, {})
+        for key, value in series:
+            key = tuple(map(tuple, key))
+            merged[key] = merged.get(key, 0) + value
+    for name, series in data.get('histograms', {}).items():
+        merged = histograms.setdefault(name, {})
+        for key, counts in series:
+            key = tuple(map(tuple, key))
+            current = merged.get(key)
+            merged[key] = counts if current is None else [a + b for a, b in zip(current, counts)]
+
+
+def _worker_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"worker.{pid}.json")
+
+
+def publish():
+    """Write this process's metrics where a scrape of another worker can read them"""
+    if not METRICS_DIR or fcntl is None:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _dump(_worker_path(os.getpid()), _copy())
+    except OSError as e:
+        logger.warning(f"Could not publish metrics: {str(e)}")
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists but belongs to another user
+    return True
+
+
+@contextmanager
+def _dir_lock():
+    with open(os.path.join(METRICS_DIR, 'metrics.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _worker_files() -> Dict[str, bool]:
+    """Path of every worker file, and whether its process is still running"""
+    files = {}
+    for name in os.listdir(METRICS_DIR):
+        pid = name[len('worker.'):-len('.json')]
+        if name.startswith('worker.') and name.endswith('.json') and pid.isdigit():
+            files[os.path.join(METRICS_DIR, name)] = int(pid) == os.getpid() or _pid_alive(int(pid))
+    return files
+
+
+def _retire_exited_workers():
+    """Fold the files of exited workers into one, so their counts stay but their files do not pile up"""
+    with _dir_lock():
+        exited = [path for path, alive in _worker_files().items() if not alive]
+        if not exited:
+            return
+        retired_path = os.path.join(METRICS_DIR, 'retired.json')
+        total: Series = ({}, {})
+        for path in [retired_path] + exited:
+            _load_into(total, path)
+        _dump(retired_path, total)
+        for path in exited:
+            os.remove(path)
+
+
+def _join():
+    """Register this process in METRICS_DIR, starting from zero if no earlier worker is still running"""
+    if not METRICS_DIR or fcntl is None:
+        return
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with _dir_lock():
+            if not any(_worker_files().values()):
+                # A fresh start of the app: counts from a previous run are not carried over
+                for name in os.listdir(METRICS_DIR):
+                    if name.endswith('.json'):
+                        os.remove(os.path.join(METRICS_DIR, name))
+            _dump(_worker_path(os.getpid()), _copy())
+    except OSError as e:
+        logger.warning(f"Could not set up shared metrics in {METRICS_DIR}: {str(e)}")
+
+
+def _collect() -> Series:
+    """Metrics of every worker on the host, this one's up to date"""
+    if not METRICS_DIR or fcntl is None:
+        return _copy()
+    publish()
+    total: Series = ({}, {})
+    try:
+        _retire_exited_workers()
+        names = sorted(os.listdir(METRICS_DIR))
+    except OSError as e:
+        logger.warning(f"Could not read the other workers' metrics: {str(e)}")
+        return _copy()
+    for name in names:
+        if name.endswith('.json'):
+            _load_into(total, os.path.join(METRICS_DIR, name))
+    return total
+
+
+def _publish_periodically():
+    while True:
+        time.sleep(PUBLISH_INTERVAL)
+        publish()
+
+
+def _start_publisher():
+    if METRICS_DIR and fcntl is not None and PUBLISH_INTERVAL > 0:
+        threading.Thread(target=_publish_periodically, name='metrics-publisher', daemon=True).start()
+
+
+def _reset_after_fork():
+    # A forked worker starts from zero; the parent's counts are in the parent's own file
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+    _start_publisher()
+
+
+_join()
+_start_publisher()
+atexit.register(publish)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=publish, after_in_child=_reset_after_fork)
+
+
+def _format_labels(key: LabelKey, extra: str = '') -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def render_prometheus() -> str:
+    """All metrics of the host's workers in the Prometheus text exposition format
+
+    Each worker publishes its own metrics every PUBLISH_INTERVAL seconds, so
+    the other workers' share of a scrape may be that far behind. Workers that
+    exited keep counting towards the totals, as counters must not go down.
+    """
+    counters, histograms = _collect()
+    lines = []
+    for name, series in sorted(counters.items()):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(series.items()):
+            lines.append(f"{name}{_format_labels(key)} {value:g}")
+
+    for name, series in sorted(histograms.items()):
+        lines.append(f"# HELP {name} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                le = 'le="%g"' % bound
+                lines.append(f"{name}_bucket{_format_labels(key, le)} {cumulative}")
+            cumulative += counts[len(BUCKETS)]
+            le = 'le="+Inf"'
+            lines.append(f"{name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(key)} {counts[-1]:.6f}")
+            lines.append(f"{name}_count{_format_labels(key)} {cumulative}")
+    return '\n'.join(lines) + '\n'
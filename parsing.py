@@ -0,0 +1,264 @@
+import random
+import re
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# Rupee multipliers for the units people type after an amount
+UNITS = {
+    'crore': 10000000, 'crores': 10000000, 'cr': 10000000, 'crs': 10000000,
+    'lakh': 100000, 'lakhs': 100000, 'lac': 100000, 'lacs': 100000, 'l': 100000,
+    'thousand': 1000, 'k': 1000,
+}
+
+NUMBER_WORDS = {'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6}
+
+WEEKDAYS = {
+    'monday': 0, 'mon': 0, 'tuesday': 1, 'tue': 1, 'tues': 1, 'wednesday': 2, 'wed': 2,
+    'thursday': 3, 'thu': 3, 'thurs': 3, 'friday': 4, 'fri': 4, 'saturday': 5, 'sat': 5,
+    'sunday': 6, 'sun': 6,
+}
+
+# An amount: optional currency marker, digits with Indian/Western commas, optional
+# decimals and unit. Numbers that are really BHK counts ("3 bhk") are skipped. The
+# lookbehinds keep a match from starting inside a number ("1.5") but allow "rs.50".
+_AMOUNT_RE = re.compile(
+    r'(?:₹|\brs\.?|\binr)?\s*'
+    r'(?<!\d)(?<!\d\.)(\d[\d,]*(?:\.\d+)?)\s*'
+    r'(crores?|crs?|lakhs?|lacs?|l|thousand|k)?\b'
+    r'(?!\s*(?:bhk|bed|bd|rk))',
+    re.IGNORECASE
+)
+_MAX_ONLY_RE = re.compile(r'\b(?:under|below|upto|up to|max(?:imum)?|within|less than|not more than|budget of)\b')
+_MIN_ONLY_RE = re.compile(r'\b(?:above|over|more than|min(?:imum)?|at least|starting|from)\b')
+_RANGE_SEP_RE = re.compile(r'\d\s*(?:[a-z]+\s*)?(?:-|–|to|and)\s*(?:₹|rs\.?)?\s*\d')
+_BHK_RE = re.compile(
+    r'\b(\d+|one|two|three|four|five|six)\s*-?\s*(?:bhk|bed(?:room)?s?|bd|b\.h\.k)\b'
+    r'|\b(\d+)\s*rk\b',
+    re.IGNORECASE
+)
+_DAY_RE = re.compile(
+    r'\b(today|tonight|tomorrow|tmrw|tmr|day after tomorrow|day after|'
+    + '|'.join(sorted(WEEKDAYS, key=len, reverse=True)) + r')\b'
+)
+_TIME_RE = re.compile(
+    r'\b(?:at\s*)?(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm|a\.m\.|p\.m\.)'
+    r'|\b(?:at\s*)?([01]?\d|2[0-3])[:.](\d{2})\b'
+    r'|\b(morning|noon|afternoon|evening)\b'
+)
+_PART_OF_DAY = {'morning': 10, 'noon': 12, 'afternoon': 15, 'evening': 18}
+_CONFIRM_RE = re.compile(r'\b(?:yes|yeah|yep|yup|sure|ok|okay|confirm)\b')
+# Phrases with a 'no' in them that do not turn anything down
+_NOT_NEGATION_RE = re.compile(r"\b(?:no|not a|not an) (?:problem|prob|issues?|worries|worry)\b|\bwhy not\b|\bnot bad\b")
+_NEGATION_RE = re.compile(r"\b(?:no|nope|nah|not|never|cancel|don['’]?t|do not|can['’]?t|cannot|won['’]?t)\b")
+
+
+def _amount_tokens(text: str):
+    """(value, unit multiplier or None) for each amount in the text"""
+    tokens = []
+    for number, unit in _AMOUNT_RE.findall(text):
+        try:
+            value = float(number.replace(',', ''))
+        except ValueError:
+            continue
+        tokens.append((value, UNITS[unit.lower()] if unit else None))
+    return tokens
+
+
+@lru_cache(maxsize=4096)
+def parse_amount(text: str) -> int:
+    """Parse a single amount like '1.5 Cr', '80 L', '₹45,00,000' or '50k' to rupees; 0 if none"""
+    tokens = _amount_tokens(str(text).lower())
+    if not tokens:
+        return 0
+    value, multiplier = tokens[0]
+    return int(round(value * (multiplier or 1)))
+
+
+@lru_cache(maxsize=4096)
+def parse_budget(text: str) -> Optional[Tuple[int, Optional[int]]]:
+    """Parse a budget reply into (min, max) rupees; max is None for open-ended budgets.
+
+    '1.5 cr to 2 cr' -> (15000000, 20000000), '50 to 80 lakhs' -> (5000000, 8000000),
+    'under 1cr' -> (0, 10000000), 'above 2 cr' -> (20000000, None) and a single
+    amount is taken as the upper limit. Returns None if no amount is found.
+    """
+    text = str(text).lower()
+    tokens = _amount_tokens(text)
+    if not tokens:
+        return None
+
+    if len(tokens) >= 2 and _RANGE_SEP_RE.search(text):
+        (low, low_unit), (high, high_unit) = tokens[0], tokens[1]
+        # "50 to 80 lakhs": the unit after the second number applies to both
+        low_amount = int(round(low * (low_unit or high_unit or 1)))
+        high_amount = int(round(high * (high_unit or 1)))
+        return (min(low_amount, high_amount), max(low_amount, high_amount))
+
+    value, unit = tokens[0]
+    amount = int(round(value * (unit or 1)))
+    if amount <= 0:
+        return None
+    if _MIN_ONLY_RE.search(text) and not _MAX_ONLY_RE.search(text):
+        return (amount, None)
+    return (0, amount)
+
+
+@lru_cache(maxsize=1024)
+def parse_bhk(text: str) -> Optional[int]:
+    """Extract the BHK count from text like '3BHK apartment' or 'two bedroom flat'; 1 RK counts as 1"""
+    match = _BHK_RE.search(str(text))
+    if not match:
+        return None
+    count = match.group(1) or match.group(2)
+    return NUMBER_WORDS.get(count.lower()) or int(count)
+
+
+@lru_cache(maxsize=1024)
+def _parse_visit_parts(text: str) -> Optional[Tuple[Optional[str], Optional[int], int]]:
+    """(day word, hour, minute) found in the text, before resolving against the clock"""
+    day_match = _DAY_RE.search(text)
+    time_match = _TIME_RE.search(text)
+    if not day_match and not time_match:
+        return None
+
+    hour, minute = None, 0
+    if time_match:
+        if time_match.group(1):
+            hour = int(time_match.group(1)) % 12
+            minute = int(time_match.group(2) or 0)
+            if time_match.group(3).startswith('p'):
+                hour += 12
+        elif time_match.group(4):
+            hour, minute = int(time_match.group(4)), int(time_match.group(5))
+        else:
+            hour = _PART_OF_DAY[time_match.group(6)]
+        if hour > 23 or minute > 59:
+            hour, minute = None, 0
+    return (day_match.group(1) if day_match else None, hour, minute)
+
+
+def parse_visit_time(text: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Resolve phrases like 'tomorrow at 4 PM', 'friday 11am' or 'today 17:30' to a datetime.
+
+    A time that has already passed today moves to the next day; without a
+    time, 11 AM is assumed. Returns None if the text names neither, or if it
+    turns a visit down ('no, not today').
+    """
+    text = str(text).lower()
+    if is_refusal(text):
+        return None
+    parts = _parse_visit_parts(text)
+    if parts is None:
+        return None
+    day, hour, minute = parts
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if day in ('today', 'tonight') or day is None:
+        date = today
+    elif day in ('tomorrow', 'tmrw', 'tmr'):
+        date = today + timedelta(days=1)
+    elif day.startswith('day after'):
+        date = today + timedelta(days=2)
+    else:
+        ahead = (WEEKDAYS[day] - today.weekday()) % 7 or 7
+        date = today + timedelta(days=ahead)
+
+    if hour is None:
+        hour = 19 if day == 'tonight' else 11
+    visit = date.replace(hour=hour, minute=minute)
+    if visit <= now:
+        visit += timedelta(days=1)
+    return visit
+
+
+def is_refusal(text: str) -> bool:
+    """Whether a reply turns something down, e.g. 'no' or 'not today', but not 'no problem'"""
+    return bool(_NEGATION_RE.search(_NOT_NEGATION_RE.sub(' ', str(text).lower())))
+
+
+def is_confirmation(text: str) -> bool:
+    """Whether a reply says yes and does not also say no"""
+    text = str(text).lower()
+    return bool(_CONFIRM_RE.search(text)) and not is_refusal(text)
+
+
+# Inputs with known answers, plus the shapes that broke the old substring checks
+FUZZ_CORPUS = [
+    ('1cr', (0, 10000000)),
+    ('1.5 cr', (0, 15000000)),
+    ('50lakhs', (0, 5000000)),
+    ('flat 50 lakhs', (0, 5000000)),
+    ('80 L', (0, 8000000)),
+    ('₹45,00,000', (0, 4500000)),
+    ('rs. 1,20,00,000', (0, 12000000)),
+    ('rs.1,20,00,000', (0, 12000000)),
+    ('rs.50 lakh', (0, 5000000)),
+    ('inr75l', (0, 7500000)),
+    ('1.5 cr to 2 cr', (15000000, 20000000)),
+    ('50 to 80 lakhs', (5000000, 8000000)),
+    ('80l-1.2cr', (8000000, 12000000)),
+    ('between 60 and 90 lacs', (6000000, 9000000)),
+    ('under 1 crore', (0, 10000000)),
+    ('above 2 cr', (20000000, None)),
+    ('3bhk around 75 lakh', (0, 7500000)),
+    ('500k', (0, 500000)),
+    ('lots of money', None),
+    ('', None),
+    ('l', None),
+    ('cr', None),
+    # Declined visits: no amount, and no visit may be booked from them
+    ('no, not today', None),
+    ('not tomorrow, sorry', None),
+    ("don't book anything", None),
+    ('no thanks, maybe friday', None),
+    ("sorry, can't make it tomorrow", None),
+    # Accepted visits that only sound negative
+    ('sure, no problem', None),
+    ('no worries, tomorrow morning works', None),
+    ('why not, saturday evening', None),
+]
+# Replies in the corpus that accept a visit despite a 'no' or 'not'
+ACCEPTED_IDIOMS = ('sure, no problem', 'no worries, tomorrow morning works', 'why not, saturday evening')
+
+
+if __name__ == "__main__":
+    for text, expected in FUZZ_CORPUS:
+        assert parse_budget(text) == expected, f"{text!r}: {parse_budget(text)} != {expected}"
+    assert parse_bhk('3BHK apartment') == 3 and parse_bhk('two bedroom flat') == 2
+    assert parse_bhk('1 rk') == 1 and parse_bhk('villa') is None
+    reference = datetime(2026, 10, 18, 12, 0)  # a Sunday
+    assert parse_visit_time('yes, tomorrow at 4 pm', reference) == datetime(2026, 10, 19, 16, 0)
+    assert parse_visit_time('friday 11:30am', reference) == datetime(2026, 10, 23, 11, 30)
+    assert parse_visit_time('at 10 am', reference) == datetime(2026, 10, 19, 10, 0)
+    assert parse_visit_time('sounds good', reference) is None
+    evening = datetime(2026, 10, 18, 18, 0)
+    assert parse_visit_time('yes today', evening) == datetime(2026, 10, 19, 11, 0)
+    assert parse_visit_time('today at 7 pm', evening) == datetime(2026, 10, 18, 19, 0)
+    assert parse_visit_time('yes, tomorrow at 4 pm, no problem', reference) == datetime(2026, 10, 19, 16, 0)
+    for text in ACCEPTED_IDIOMS:
+        assert not is_refusal(text) and (is_confirmation(text) or parse_visit_time(text, reference)), text
+    for text, _ in FUZZ_CORPUS:
+        if is_refusal(text):
+            assert parse_visit_time(text, reference) is None and not is_confirmation(text), text
+
+    # Random junk must never raise
+    rng = random.Random(7)
+    alphabet = '0123456789.,-₹ lLcrkbhtoamp:'
+    for _ in range(20000):
+        junk = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        parse_budget(junk)
+        parse_bhk(junk)
+        parse_visit_time(junk, reference)
+    print(f"Fuzz corpus: {len(FUZZ_CORPUS)} cases and 20000 random inputs OK")
+
+    # Throughput, uncached vs. cached for repeated phrasings
+    phrasings = [text for text, _ in FUZZ_CORPUS] * 500
+    for label, func in (('uncached', parse_budget.__wrapped__), ('cached', parse_budget)):
+        started = time.perf_counter()
+        for text in phrasings:
+            func(text)
+        elapsed = time.perf_counter() - started
+        print(f"parse_budget {label:9s} {len(phrasings) / elapsed:12,.0f} parses/s")
@@ -0,0 +1,83 @@
+import logging
+import os
+import time
+
+from twiml import TwimlResponse
+from session_store import SessionStore, create_session_store
+from metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Messages a sender can send per minute once their burst is spent; 0 disables the limit
+RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', '20'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '10'))
+# 'memory' keeps buckets per worker; 'sqlite' shares them through the session database
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+
+ALLOWED = 'allowed'
+THROTTLED = 'throttled'
+SILENCED = 'silenced'
+
+
+def _reply(text: str) -> str:
+    response = TwimlResponse()
+    response.message(text)
+    return str(response)
+
+
+THROTTLED_REPLY = _reply("You're sending messages faster than we can answer. Please wait a minute and try again.")
+# Further messages from a sender who was already told to slow down get no message at all
+SILENCED_REPLY = str(TwimlResponse())
+
+
+class SenderLimiter:
+    """Token bucket per sender number, kept in a ``SessionStore``.
+
+    Entries expire once an empty bucket would have refilled, so a missing
+    entry means a full bucket and the store holds only recent senders. A
+    throttled sender is told once; until their bucket refills, further
+    messages get an empty reply and touch neither the session nor Sheets.
+
+    With a shared backend the read-modify-write is not atomic across
+    workers, so concurrent messages from one sender may each take the same
+    token. That is close enough to stop a flood.
+    """
+
+    def __init__(self, store: SessionStore, rate_per_minute: float = RATE_LIMIT_PER_MINUTE,
+                 burst: int = RATE_LIMIT_BURST):
+        self.store = store
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+
+    def check(self, sender: str) -> str:
+        """Spend one of the sender's tokens; returns ALLOWED, THROTTLED or SILENCED"""
+        if self.rate <= 0:
+            return ALLOWED
+        now = time.time()
+        entry = self.store.get(sender)
+        if entry is None:
+            tokens, warned = float(self.burst), False
+        else:
+            tokens = min(self.burst, entry['tokens'] + (now - entry['at']) * self.rate)
+            warned = entry.get('warned', False)
+
+        if tokens >= 1:
+            self.store.set(sender, {'tokens': tokens - 1, 'at': now})
+            return ALLOWED
+        if warned:
+            inc('bot_rate_limited_total', outcome=SILENCED)
+            return SILENCED
+        self.store.set(sender, {'tokens': tokens, 'at': now, 'warned': True})
+        inc('bot_rate_limited_total', outcome=THROTTLED)
+        logger.info("Throttling %s", sender)
+        return THROTTLED
+
+    def reply(self, verdict: str) -> str:
+        """TwiML for a rejected message"""
+        return THROTTLED_REPLY if verdict == THROTTLED else SILENCED_REPLY
+
+
+def create_sender_limiter() -> SenderLimiter:
+    """Sender limiter on the backend selected by RATE_LIMIT_BACKEND"""
+    ttl = RATE_LIMIT_BURST * 60.0 / RATE_LIMIT_PER_MINUTE if RATE_LIMIT_PER_MINUTE > 0 else 60.0
+    return SenderLimiter(create_session_store(RATE_LIMIT_BACKEND, ttl=ttl, table='rate_limits'))
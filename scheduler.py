@@ -0,0 +1,214 @@
+import logging
+import os
+import random
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Hashable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, each worker takes a share of the quota
+    fcntl = None
+
+import requests
+from gspread.exceptions import APIError
+
+from metrics import inc, timed
+
+logger = logging.getLogger(__name__)
+
+# Sheets API quota is per minute; keep under it and allow short bursts
+RATE_PER_MINUTE = float(os.getenv('SHEETS_RATE_PER_MINUTE', '60'))
+BURST = int(os.getenv('SHEETS_BURST', '10'))
+MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', '4'))
+BASE_DELAY = float(os.getenv('SHEETS_RETRY_BASE_SECONDS', '1'))
+MAX_DELAY = float(os.getenv('SHEETS_RETRY_MAX_SECONDS', '32'))
+# File holding the token bucket every worker on the host draws from; empty keeps one per process
+BUCKET_PATH = os.getenv('SHEETS_BUCKET_PATH', 'sheets_bucket.state')
+# Worker processes splitting the quota when the bucket cannot be shared (gunicorn's setting)
+WORKERS = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def is_ambiguous(error: Exception) -> bool:
+    """Whether a failed call may still have been applied (5xx, dropped or timed-out connection)"""
+    if isinstance(error, APIError):
+        return getattr(error.response, 'status_code', None) in RETRYABLE_STATUS - {429}
+    if isinstance(error, requests.ConnectTimeout):
+        return False  # never reached the server
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def is_retryable(error: Exception, idempotent: bool = True) -> bool:
+    """Quota (429), server-side (5xx) and connection errors are worth retrying
+
+    A call that is not idempotent, such as an append, is only retried when
+    it certainly was not applied; repeating it after an ambiguous failure
+    could write the rows twice.
+    """
+    if isinstance(error, APIError):
+        status = getattr(error.response, 'status_code', None)
+        return status == 429 or (idempotent and status in RETRYABLE_STATUS)
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    return idempotent and isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class TokenBucket:
+    """Thread-safe token bucket; ``acquire`` blocks until a token is free"""
+
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, returning how long the caller waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class SharedTokenBucket:
+    """Token bucket kept in a small file under ``flock``, shared by every worker on the host.
+
+    The Sheets quota is per project, so per-process buckets would let N
+    gunicorn workers send N times the configured rate. Hosts do not share the
+    file; with several, set SHEETS_RATE_PER_MINUTE to each host's share.
+    """
+
+    _STATE = struct.Struct('dd')  # tokens, wall-clock time of the last update
+
+    def __init__(self, path: str, rate_per_second: float, capacity: int):
+        self.path = path
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self._fd: Optional[int] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _file(self) -> int:
+        # flock is held per open file, and a forked child shares its parent's, so reopen per process
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def acquire(self) -> float:
+        """Take one token, returning how long the caller waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                fd = self._file()
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    now = time.time()
+                    data = os.pread(fd, self._STATE.size, 0)
+                    if len(data) == self._STATE.size:
+                        tokens, updated = self._STATE.unpack(data)
+                        tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+                    else:
+                        tokens = float(self.capacity)
+                    delay = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                    if not delay:
+                        tokens -= 1
+                    os.pwrite(fd, self._STATE.pack(tokens, now), 0)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+def create_bucket(rate_per_minute: float = RATE_PER_MINUTE, burst: int = BURST):
+    """One bucket for the host's workers, or this process's share of the quota"""
+    if fcntl is not None and BUCKET_PATH:
+        return SharedTokenBucket(BUCKET_PATH, rate_per_minute / 60.0, burst)
+    workers = max(1, WORKERS)
+    return TokenBucket(rate_per_minute / 60.0 / workers, max(1, burst // workers))
+
+
+class SheetsScheduler:
+    """Single gate for every Google Sheets API call in the process.
+
+    Calls are paced by a token bucket sized to the quota and shared by the
+    workers on the host (see ``create_bucket``), retried with
+    exponential backoff and full jitter on 429/5xx/connection errors, and
+    identical reads that are already in flight are merged so concurrent
+    callers share one request.
+    """
+
+    def __init__(self, rate_per_minute: float = RATE_PER_MINUTE, burst: int = BURST,
+                 max_retries: int = MAX_RETRIES, base_delay: float = BASE_DELAY,
+                 max_delay: float = MAX_DELAY):
+        self.bucket = create_bucket(rate_per_minute, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._inflight: Dict[Hashable, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    def call(self, name: str, func, *args, coalesce_key: Optional[Hashable] = None,
+             idempotent: bool = True, **kwargs) -> Any:
+        """Run ``func`` under the quota; callers with the same ``coalesce_key`` share one call"""
+        if coalesce_key is None:
+            return self._run(name, func, args, kwargs, idempotent)
+
+        with self._inflight_lock:
+            future = self._inflight.get(coalesce_key)
+            leader = future is None
+            if leader:
+                future = self._inflight[coalesce_key] = Future()
+        if not leader:
+            inc('bot_sheets_coalesced_total', call=name)
+            return future.result()
+
+        try:
+            result = self._run(name, func, args, kwargs, idempotent)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(coalesce_key, None)
+
+    def _run(self, name: str, func, args, kwargs, idempotent: bool = True) -> Any:
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket.acquire()
+            if waited:
+                inc('bot_sheets_throttled_seconds_total', waited, call=name)
+            try:
+                with timed('bot_sheets_call_seconds', call=name):
+                    return func(*args, **kwargs)
+            except Exception as e:
+                inc('bot_sheets_errors_total', call=name)
+                retryable = is_retryable(e, idempotent)
+                if not retryable or attempt == self.max_retries:
+                    if retryable:
+                        inc('bot_sheets_dropped_total', call=name)
+                        logger.error("Sheets %s failed after %d attempts: %s", name, attempt + 1, e)
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                inc('bot_sheets_retries_total', call=name)
+                logger.warning("Sheets %s failed (%s), retry %d in %.1fs", name, e, attempt + 1, delay)
+                time.sleep(delay)
+
+
+scheduler = SheetsScheduler()
@@ -0,0 +1,162 @@
+import heapq
+import random
+import re
+import time
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Set, Tuple
+
+from listings import Catalog, Property
+
+# Minimum share of the query's trigrams a location must contain to match
+LOCATION_MATCH_THRESHOLD = 0.5
+# Location replies that mean "don't filter by location"
+ANY_LOCATION = {'', 'any', 'anywhere', 'no', 'none', 'no preference', 'any location'}
+
+_NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
+
+
+def normalize_location(location: str) -> str:
+    """Lowercase a location and collapse punctuation/whitespace to single spaces"""
+    return _NON_ALNUM_RE.sub(' ', str(location).lower()).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    """Trigrams of each word padded with spaces, e.g. 'bandra' -> ' ba', 'ban', ..., 'ra '"""
+    grams = set()
+    for token in text.split():
+        padded = f" {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class PropertyIndex:
+    """In-memory search index over a formatted catalog.
+
+    Prices are kept in sorted arrays (overall, per BHK and per locality) so
+    budget filters are two bisections. Locations are indexed by trigram over the distinct
+    normalized locality strings, which keeps fuzzy matching cheap even when
+    thousands of listings share a locality.
+    """
+
+    def __init__(self, properties: Catalog):
+        self._ids: List[int] = list(properties)
+        self._prices: List[int] = [properties[pid].price for pid in self._ids]
+        self._bhks: List[int] = [properties[pid].bhk for pid in self._ids]
+
+        # (sorted prices, row numbers in the same order) overall and per BHK
+        self._by_price = self._sorted_by_price(range(len(self._ids)))
+        buckets: Dict[int, List[int]] = {}
+        for row, bhk in enumerate(self._bhks):
+            buckets.setdefault(bhk, []).append(row)
+        self._by_bhk = {bhk: self._sorted_by_price(rows) for bhk, rows in buckets.items()}
+
+        # Price-sorted rows per distinct locality (and per locality + BHK)
+        location_rows: Dict[str, List[int]] = {}
+        normalized: Dict[str, str] = {}
+        for row, pid in enumerate(self._ids):
+            # Locations are interned, so each distinct one is normalized once
+            raw = properties[pid].location
+            location = normalized.get(raw)
+            if location is None:
+                location = normalized[raw] = normalize_location(raw)
+            location_rows.setdefault(location, []).append(row)
+        self._by_location: Dict[Tuple[str, Optional[int]], Tuple[List[int], List[int]]] = {}
+        for location, rows in location_rows.items():
+            self._by_location[location, None] = self._sorted_by_price(rows)
+            for bhk in set(self._bhks[row] for row in rows):
+                self._by_location[location, bhk] = self._sorted_by_price(
+                    [row for row in rows if self._bhks[row] == bhk])
+
+        # Trigram -> localities containing it
+        self._location_grams: Dict[str, Set[str]] = {}
+        for location in location_rows:
+            for gram in trigrams(location):
+                self._location_grams.setdefault(gram, set()).add(location)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _sorted_by_price(self, rows) -> Tuple[List[int], List[int]]:
+        ordered = sorted(rows, key=self._prices.__getitem__)
+        return [self._prices[row] for row in ordered], ordered
+
+    def match_locations(self, query: str) -> Dict[str, float]:
+        """Score indexed localities against a free-text location query"""
+        grams = trigrams(normalize_location(query))
+        if not grams:
+            return {}
+        hits: Dict[str, int] = {}
+        for gram in grams:
+            for location in self._location_grams.get(gram, ()):
+                hits[location] = hits.get(location, 0) + 1
+        return {
+            location: count / len(grams)
+            for location, count in hits.items()
+            if count / len(grams) >= LOCATION_MATCH_THRESHOLD
+        }
+
+    def search(self, bhk: Optional[int] = None, min_price: Optional[int] = None,
+               max_price: Optional[int] = None, location: Optional[str] = None,
+               limit: int = 10) -> List[int]:
+        """Return up to ``limit`` property IDs, best match first.
+
+        Results are ranked by location match, then by price descending, so the
+        listings that make the most of the budget come first.
+        """
+        low = min_price or 0
+        high = max_price if max_price else float('inf')
+
+        if location is not None and normalize_location(location) not in ANY_LOCATION:
+            # Top ``limit`` rows within budget from each matching locality, then merge
+            candidates = []
+            for loc, score in self.match_locations(location).items():
+                prices, rows = self._by_location.get((loc, bhk or None), ([], []))
+                start = bisect_left(prices, low)
+                end = bisect_right(prices, high)
+                for pos in range(max(start, end - limit), end):
+                    candidates.append((score, prices[pos], rows[pos]))
+            best = heapq.nlargest(limit, candidates)
+            return [self._ids[row] for _, _, row in best]
+
+        prices, rows = self._by_bhk.get(bhk, ([], [])) if bhk else self._by_price
+        start = bisect_left(prices, low)
+        end = bisect_right(prices, high)
+        return [self._ids[row] for row in reversed(rows[max(start, end - limit):end])]
+
+
+def _synthetic_catalog(size: int) -> Catalog:
+    localities = [f"{area} {suffix}, {city}"
+                  for city in ('Mumbai', 'Pune', 'Bengaluru', 'Hyderabad')
+                  for area in ('Bandra', 'Andheri', 'Powai', 'Worli', 'Baner', 'Kothrud',
+                               'Whitefield', 'Indiranagar', 'Gachibowli', 'Kondapur')
+                  for suffix in ('East', 'West', 'North', 'Central', 'Sector 5')]
+    rng = random.Random(42)
+    return {
+        idx: Property(idx, f'Listing {idx}', rng.randrange(20, 500) * 100000,
+                      rng.choice(localities), rng.randint(1, 5), '')
+        for idx in range(1, size + 1)
+    }
+
+
+if __name__ == "__main__":
+    # Benchmark: build and query an index over a synthetic 100k-listing catalog
+    catalog = _synthetic_catalog(100000)
+    started = time.perf_counter()
+    index = PropertyIndex(catalog)
+    print(f"Built index over {len(index)} listings in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    queries = [
+        {'bhk': 3, 'max_price': 15000000},
+        {'bhk': 2, 'min_price': 5000000, 'max_price': 8000000},
+        {'bhk': 3, 'max_price': 15000000, 'location': 'bandra'},
+        {'bhk': 2, 'max_price': 9000000, 'location': 'andheri west'},
+        {'max_price': 30000000, 'location': 'gachibowly'},
+        {'bhk': 4, 'location': 'anywhere'},
+    ]
+    rounds = 200
+    for query in queries:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            results = index.search(limit=10, **query)
+        per_query = (time.perf_counter() - started) / rounds * 1000
+        print(f"{per_query:8.3f} ms  {len(results):2d} results  {query}")
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 'memory' (per-process LRU) or 'sqlite' (shared WAL file for all workers on a host)
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')
+# Idle conversations are dropped after this many seconds
+SESSION_TTL = float(os.getenv('SESSION_TTL_SECONDS', '86400'))
+SESSION_MAX_ENTRIES = int(os.getenv('SESSION_MAX_ENTRIES', '10000'))
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.db')
+
+
+def _dumps(value: Dict[str, Any]) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+
+class SessionStore:
+    """Key -> JSON-serializable dict store with idle expiry.
+
+    Values are stored serialized, so callers always get their own copy and
+    must ``set`` a session again after changing it.
+    """
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Dict[str, Any]):
+        raise NotImplementedError
+
+    def add(self, key: str, value: Dict[str, Any]) -> bool:
+        """Store ``value`` only if ``key`` has no live entry; True if it was stored"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """In-process LRU with a TTL; each worker keeps its own sessions"""
+
+    def __init__(self, ttl: float = SESSION_TTL, max_entries: int = SESSION_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+        return json.loads(payload)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        payload = _dumps(value)
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, payload)
+            self._data.move_to_end(key)
+            # Least recently used first; expired entries are dropped as they surface
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def add(self, key: str, value: Dict[str, Any]) -> bool:
+        payload = _dumps(value)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                return False
+            self._data[key] = (time.monotonic() + self.ttl, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return True
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a SQLite file in WAL mode, shared by every worker on the host
+
+    Other stores with the same semantics can live in the same file under
+    their own ``table``.
+    """
+
+    # Purge expired rows once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str = SESSION_DB_PATH, ttl: float = SESSION_TTL, table: str = 'sessions'):
+        self.path = path
+        self.ttl = ttl
+        self.table = table
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_expires_at ON {table} (expires_at)')
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads or across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            f'SELECT value FROM {self.table} WHERE key = ? AND expires_at >= ?', (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        conn = self._conn()
+        conn.execute(
+            f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, _dumps(value), time.time() + self.ttl)
+        )
+        self._purge_sometimes(conn)
+
+    def add(self, key: str, value: Dict[str, Any]) -> bool:
+        conn = self._conn()
+        now = time.time()
+        # Inserts a new row or takes over an expired one; a live row is left alone
+        stored = conn.execute(
+            f'INSERT INTO {self.table} (key, value, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at '
+            f'WHERE {self.table}.expires_at < ?',
+            (key, _dumps(value), now + self.ttl, now)
+        ).rowcount
+        self._purge_sometimes(conn)
+        return stored > 0
+
+    def _purge_sometimes(self, conn: sqlite3.Connection):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            purged = conn.execute(f'DELETE FROM {self.table} WHERE expires_at < ?', (time.time(),)).rowcount
+            if purged:
+                logger.info(f"Purged {purged} expired rows from {self.table}")
+
+    def delete(self, key: str):
+        self._conn().execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+
+def create_session_store(backend: str = SESSION_BACKEND, ttl: float = SESSION_TTL,
+                         table: str = 'sessions') -> SessionStore:
+    """Build the session store selected by SESSION_BACKEND"""
+    if backend == 'sqlite':
+        logger.info(f"Using SQLite {table} store at {SESSION_DB_PATH}")
+        return SQLiteSessionStore(ttl=ttl, table=table)
+    if backend != 'memory':
+        logger.warning(f"Unknown SESSION_BACKEND '{backend}', using in-memory {table}")
+    return MemorySessionStore(ttl=ttl)
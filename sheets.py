@@ -1,17 +1,25 @@
 import gspread
+import requests
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession, Request
+from gspread.urls import DRIVE_FILES_API_V3_URL
+from requests.adapters import HTTPAdapter
+from scheduler import scheduler
 import logging
-from typing import List, Dict, Any
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
 import os
 import json
 from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 
 # Load environment variables
 load_dotenv()
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging (configured by the app, see logging_config.py)
 logger = logging.getLogger(__name__)
 
 # Define the scopes
@@ -23,73 +31,239 @@ SCOPES = [
 # Define absolute path for credentials
 CREDENTIALS_PATH = r"C:\Users\darsh\OneDrive\Desktop\whatsapp-bot\credentials.json"
 
+# Process-wide client state, shared by every request thread in the worker
+_client_lock = threading.RLock()
+_client = None
+_credentials = None
+# Plain session for OAuth token requests: going through the AuthorizedSession would
+# refresh the expired token first and send the old bearer token to the token endpoint
+_token_session = None
+_spreadsheet = None
+_worksheets: Dict[Any, Any] = {}
+
+# Refresh the OAuth token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = int(os.getenv('SHEETS_TOKEN_REFRESH_MARGIN', '300'))
+# Size of the keep-alive connection pool used for Sheets/Drive requests
+HTTP_POOL_SIZE = int(os.getenv('SHEETS_HTTP_POOL_SIZE', '10'))
+
+INTERACTIONS_SHEET = 'UserInteractions'
+INTERACTIONS_HEADERS = [
+    'Timestamp',
+    'Phone Number',
+    'Property Type',
+    'Budget',
+    'Location',
+    'Selected Property',
+    'Visit Schedule',
+    'Status'
+]
+
+# SQLite file holding the phone -> latest UserInteractions row index for every
+# worker on the host; by default the session database
+ROW_INDEX_PATH = os.getenv('INTERACTION_INDEX_PATH', os.getenv('SESSION_DB_PATH', 'sessions.db'))
+# A phone number missing from the index rereads the phone column at most this often...
+ROW_INDEX_REBUILD_INTERVAL = float(os.getenv('INTERACTION_INDEX_REBUILD_SECONDS', '300'))
+# ...and it is reread at least this often, to pick up rows edited by hand
+ROW_INDEX_MAX_AGE = float(os.getenv('INTERACTION_INDEX_MAX_AGE_SECONDS', '86400'))
+_RANGE_START_RE = re.compile(r'![A-Z]+(\d+)')
+
+PHONE_COL = 2  # Column B
+PHONE_COLUMN = 'B'
+STATUS_COL = 8  # Column H
+
+def _freeze(value):
+    """Hashable stand-in for call arguments, e.g. a ``params`` dict"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def sheets_call(call: str, func, *args, coalesce: bool = False, idempotent: bool = True, **kwargs):
+    """Run one Sheets API call through the process-wide scheduler
+
+    The scheduler paces calls to the quota, retries 429/5xx with backoff and
+    records timings. With ``coalesce`` a read already in flight with the same
+    call name, target object (worksheet, client) and arguments, keyword
+    arguments included, is shared instead of being sent again. Calls that are not ``idempotent`` are not
+    retried after a failure that may have been applied.
+    """
+    coalesce_key = None
+    if coalesce:
+        coalesce_key = (call, id(getattr(func, '__self__', None)), _freeze(args), _freeze(kwargs))
+    return scheduler.call(call, func, *args, coalesce_key=coalesce_key, idempotent=idempotent, **kwargs)
+
+def _load_credentials():
+    """Load service account credentials from the environment or credentials file"""
+    # First try to get credentials from environment variable
+    creds_json = os.getenv('GOOGLE_CREDENTIALS')
+    if creds_json:
+        try:
+            # Parse the JSON string from environment variable
+            creds_dict = json.loads(creds_json)
+            creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+            logger.info("Loaded Google credentials from environment")
+            return creds
+        except json.JSONDecodeError as e:
+            logger.error(f"Error parsing credentials JSON: {str(e)}")
+
+    # Fallback to credentials file using absolute path
+    if os.path.exists(CREDENTIALS_PATH):
+        logger.info(f"Using credentials file at: {CREDENTIALS_PATH}")
+        return Credentials.from_service_account_file(CREDENTIALS_PATH, scopes=SCOPES)
+
+    logger.error(f"credentials.json file not found at: {CREDENTIALS_PATH}")
+    logger.error("No credentials found in environment variables or credentials file")
+    return None
+
+def _refresh_token_if_needed():
+    """Refresh the access token ahead of expiry so requests never wait on it"""
+    expiry = _credentials.expiry
+    if _credentials.token and expiry and expiry - datetime.utcnow() > timedelta(seconds=TOKEN_REFRESH_MARGIN):
+        return
+    sheets_call('token_refresh', _credentials.refresh, Request(_token_session))
+    logger.info("Refreshed Google Sheets access token")
+
 def get_sheets_client():
-    """Initialize and return Google Sheets client"""
+    """Return the shared Google Sheets client, creating it on first use"""
+    global _client, _credentials, _token_session
     try:
-        # First try to get credentials from environment variable
-        creds_json = os.getenv('GOOGLE_CREDENTIALS')
-        if creds_json:
-            try:
-                # Parse the JSON string from environment variable
-                creds_dict = json.loads(creds_json)
-                creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-                client = gspread.authorize(creds)
-                logger.info("Successfully initialized Google Sheets client using environment credentials")
-                return client
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing credentials JSON: {str(e)}")
-        
-        # Fallback to credentials file using absolute path
-        if os.path.exists(CREDENTIALS_PATH):
-            logger.info(f"Using credentials file at: {CREDENTIALS_PATH}")
-            creds = Credentials.from_service_account_file(CREDENTIALS_PATH, scopes=SCOPES)
-            client = gspread.authorize(creds)
-            logger.info("Successfully initialized Google Sheets client using credentials file")
-            return client
-        else:
-            logger.error(f"credentials.json file not found at: {CREDENTIALS_PATH}")
-            
-        logger.error("No credentials found in environment variables or credentials file")
-        return None
-            
+        with _client_lock:
+            if _client is None:
+                creds = _load_credentials()
+                if not creds:
+                    return None
+
+                # One keep-alive session with a pool sized for the worker's threads
+                session = AuthorizedSession(creds)
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount('https://', adapter)
+
+                token_session = requests.Session()
+                token_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+
+                _credentials = creds
+                _token_session = token_session
+                _client = gspread.Client(auth=creds, session=session)
+                logger.info("Successfully initialized Google Sheets client")
+
+            _refresh_token_if_needed()
+            return _client
+
     except Exception as e:
         logger.error(f"Error initializing Google Sheets client: {str(e)}")
         return None
 
-def get_property_data() -> List[Dict[str, Any]]:
-    """Fetch property data from Google Sheets"""
-    try:
-        client = get_sheets_client()
-        if not client:
-            logger.error("Could not initialize Google Sheets client")
-            return []
+def get_spreadsheet():
+    """Return the cached spreadsheet handle, opening it on first use"""
+    global _spreadsheet
+    client = get_sheets_client()
+    if not client:
+        logger.error("Could not initialize Google Sheets client")
+        return None
 
-        # Get spreadsheet ID and name from environment variables
-        sheet_id = os.getenv('GOOGLE_SHEET_ID')
-        sheet_name = os.getenv('GOOGLE_SHEET_NAME', 'RealEstateData')
+    with _client_lock:
+        if _spreadsheet is None:
+            # Get spreadsheet ID and name from environment variables
+            sheet_id = os.getenv('GOOGLE_SHEET_ID')
+            sheet_name = os.getenv('GOOGLE_SHEET_NAME', 'RealEstateData')
 
-        logger.info(f"Attempting to access sheet: {sheet_name} (ID: {sheet_id})")
+            logger.info(f"Attempting to access sheet: {sheet_name} (ID: {sheet_id})")
 
-        # Try to open by ID first
-        try:
+            # Try to open by ID first
             if sheet_id:
-                spreadsheet = client.open_by_key(sheet_id)
+                _spreadsheet = sheets_call('open_by_key', client.open_by_key, sheet_id)
                 logger.info(f"Successfully opened spreadsheet by ID: {sheet_id}")
             else:
-                spreadsheet = client.open(sheet_name)
+                _spreadsheet = sheets_call('open', client.open, sheet_name)
                 logger.info(f"Successfully opened spreadsheet by name: {sheet_name}")
+        return _spreadsheet
+
+def get_worksheet(key):
+    """Return a cached worksheet handle by index or title"""
+    spreadsheet = get_spreadsheet()
+    if not spreadsheet:
+        return None
+
+    with _client_lock:
+        if key not in _worksheets:
+            if isinstance(key, int):
+                _worksheets[key] = sheets_call('get_worksheet', spreadsheet.get_worksheet, key)
+            else:
+                _worksheets[key] = sheets_call('worksheet', spreadsheet.worksheet, key)
+        return _worksheets[key]
+
+def get_interactions_worksheet():
+    """Return the UserInteractions worksheet, creating it with headers if missing"""
+    try:
+        worksheet = get_worksheet(INTERACTIONS_SHEET)
+        logger.debug("Found existing UserInteractions sheet")
+        return worksheet
+    except gspread.WorksheetNotFound:
+        spreadsheet = get_spreadsheet()
+        with _client_lock:
+            worksheet = sheets_call('add_worksheet', spreadsheet.add_worksheet, INTERACTIONS_SHEET, 1000, 10,
+                                    idempotent=False)
+            sheets_call('append_row', worksheet.append_row, INTERACTIONS_HEADERS, idempotent=False)
+            _worksheets[INTERACTIONS_SHEET] = worksheet
+        logger.info("Created new UserInteractions sheet with headers")
+        return worksheet
+
+def reset_sheet_handles():
+    """Drop cached spreadsheet/worksheet handles so the next call reopens them"""
+    global _spreadsheet
+    with _client_lock:
+        _spreadsheet = None
+        _worksheets.clear()
+
+def _reset_after_fork():
+    # Workers forked from a preloaded parent open their own client and connections
+    global _client, _credentials, _token_session, _spreadsheet
+    _client = _credentials = _token_session = _spreadsheet = None
+    _worksheets.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_catalog_revision():
+    """Return the Drive revision marker of the property spreadsheet, or None if unknown"""
+    try:
+        spreadsheet = get_spreadsheet()
+        if not spreadsheet:
+            return None
+        res = sheets_call(
+            'drive_revision',
+            spreadsheet.client.request,
+            'get',
+            f"{DRIVE_FILES_API_V3_URL}/{spreadsheet.id}",
+            params={'fields': 'modifiedTime,version', 'supportsAllDrives': True},
+            coalesce=True
+        )
+        meta = res.json()
+        return f"{meta.get('version')}:{meta.get('modifiedTime')}"
+    except Exception as e:
+        logger.warning(f"Could not read spreadsheet revision: {str(e)}")
+        return None
+
+def get_property_data() -> List[Dict[str, Any]]:
+    """Fetch property data from Google Sheets"""
+    try:
+        try:
+            spreadsheet = get_spreadsheet()
         except Exception as e:
             logger.error(f"Error opening spreadsheet: {str(e)}")
             return []
+        if not spreadsheet:
+            return []
 
         # Get the first worksheet
-        worksheet = spreadsheet.get_worksheet(0)
+        worksheet = get_worksheet(0)
         if not worksheet:
             logger.error("No worksheet found in the spreadsheet")
             return []
 
         # Get all records
-        records = worksheet.get_all_records()
+        records = sheets_call('get_all_records', worksheet.get_all_records, coalesce=True)
         
         # Log the data found
         logger.info(f"Found {len(records)} records in the spreadsheet")
@@ -103,121 +277,248 @@ def get_property_data() -> List[Dict[str, Any]]:
 
     except Exception as e:
         logger.error(f"Error fetching property data: {str(e)}")
+        reset_sheet_handles()
         return []
 
-def format_property_data(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
-    """Format property data into a dictionary"""
-    formatted_data = {}
+def build_interaction_row(user_data: Dict[str, Any]) -> List[Any]:
+    """Build a UserInteractions row, timestamped now"""
+    return [
+        datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        user_data.get('phone_number', ''),
+        user_data.get('property_type', ''),
+        user_data.get('budget', ''),
+        user_data.get('location', ''),
+        user_data.get('selected_property', ''),
+        user_data.get('visit_schedule', ''),
+        user_data.get('status', 'Inquiry')
+    ]
+
+class _RowIndex:
+    """Phone number -> latest UserInteractions row, shared by the workers on a host
+
+    Every append on the host records its rows here, so a lookup never needs
+    to read the sheet to see another worker's rows. Rows are only ever
+    raised, so appends recorded out of order still leave the latest row.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS interaction_rows (phone TEXT PRIMARY KEY, row INTEGER NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS interaction_rows_meta (key TEXT PRIMARY KEY, value REAL NOT NULL)')
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads or across a fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def record(self, rows: Dict[str, int]):
+        self._conn().executemany(
+            'INSERT INTO interaction_rows (phone, row) VALUES (?, ?) '
+            'ON CONFLICT(phone) DO UPDATE SET row = max(row, excluded.row)',
+            rows.items()
+        )
+
+    def replace(self, rows: Dict[str, int], column_length: int):
+        """Swap in the index read from a phone column ``column_length`` rows long"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Rows past the end of the column were appended after it was read and stay
+            conn.execute('DELETE FROM interaction_rows WHERE row <= ?', (column_length,))
+            conn.executemany(
+                'INSERT INTO interaction_rows (phone, row) VALUES (?, ?) '
+                'ON CONFLICT(phone) DO UPDATE SET row = max(row, excluded.row)',
+                rows.items()
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def lookup(self, phone_numbers: List[str]) -> Dict[str, int]:
+        found = {}
+        # Well under SQLite's limit on bound parameters per statement
+        for first in range(0, len(phone_numbers), 500):
+            chunk = phone_numbers[first:first + 500]
+            found.update(self._conn().execute(
+                f"SELECT phone, row FROM interaction_rows WHERE phone IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return found
+
+    def last_row(self) -> int:
+        return self._conn().execute('SELECT max(row) FROM interaction_rows').fetchone()[0] or 1
+
+    def rebuilt_at(self) -> Optional[float]:
+        row = self._conn().execute("SELECT value FROM interaction_rows_meta WHERE key = 'rebuilt_at'").fetchone()
+        return row[0] if row else None
+
+    def claim_rebuild(self, not_since: Optional[float]) -> bool:
+        """Take the next rebuild unless another worker took it since ``not_since``"""
+        return self._conn().execute(
+            "INSERT INTO interaction_rows_meta (key, value) VALUES ('rebuilt_at', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value WHERE value IS ?",
+            (time.time(), not_since)
+        ).rowcount > 0
+
+    def release_rebuild(self, previous: Optional[float]):
+        """Give back a claimed rebuild that failed, so the next miss tries again"""
+        if previous is None:
+            self._conn().execute("DELETE FROM interaction_rows_meta WHERE key = 'rebuilt_at'")
+        else:
+            self._conn().execute("UPDATE interaction_rows_meta SET value = ? WHERE key = 'rebuilt_at'", (previous,))
+
+
+_row_index_lock = threading.Lock()
+_row_index: Optional[_RowIndex] = None
+
+def _get_row_index() -> _RowIndex:
+    global _row_index
+    with _row_index_lock:
+        if _row_index is None:
+            _row_index = _RowIndex(ROW_INDEX_PATH)
+        return _row_index
+
+def _rebuild_row_index(worksheet):
+    """Index every phone number in the phone column"""
+    phone_numbers = sheets_call('col_values', worksheet.col_values, PHONE_COL, coalesce=True)
+    rows = {}
+    # Row 1 holds the headers; later rows overwrite earlier ones
+    for row, phone in enumerate(phone_numbers[1:], 2):
+        if phone:
+            rows[phone] = row
+    _get_row_index().replace(rows, len(phone_numbers))
+    logger.info(f"Indexed {len(rows)} phone numbers in UserInteractions")
+
+def append_interaction_rows(rows: List[List[Any]]) -> Optional[int]:
+    """Append rows to UserInteractions in a single API call, raising on failure
+
+    Returns the sheet row of the first appended row, or None if the API
+    response did not say where the rows landed.
+    """
     try:
-        for idx, record in enumerate(records, 1):
-            try:
-                # Log each record being processed
-                logger.info(f"Processing record {idx}: {record.get('name', 'Unnamed')}")
-                
-                # Convert price to integer, handling different formats
-                price_str = str(record.get('price', '0'))
-                try:
-                    # Handle 'Cr' format
-                    if 'cr' in price_str.lower():
-                        price = float(price_str.lower().replace('cr', '').strip()) * 10000000
-                    # Handle 'L' format
-                    elif 'l' in price_str.lower():
-                        price = float(price_str.lower().replace('l', '').strip()) * 100000
-                    else:
-                        price = float(price_str.replace(',', ''))
-                    price = int(price)
-                except (ValueError, TypeError):
-                    logger.warning(f"Invalid price format in record {idx}: {price_str}")
-                    price = 0
-
-                # Convert BHK to integer
-                try:
-                    bhk = int(float(str(record.get('bhk', '0')).replace(',', '')))
-                except (ValueError, TypeError):
-                    logger.warning(f"Invalid BHK format in record {idx}: {record.get('bhk')}")
-                    bhk = 0
-
-                # Create property entry
-                property_id = f'property{idx}'
-                formatted_data[property_id] = {
-                    'name': record.get('name', 'Unnamed Property'),
-                    'price': price,
-                    'location': record.get('location', 'Location not specified'),
-                    'bhk': bhk,
-                    'description': record.get('description', 'No description available'),
-                    'images': record.get('images', '').split(',') if record.get('images') else []
-                }
-                
-                logger.info(f"Successfully formatted property: {property_id} - {formatted_data[property_id]['name']} with price: ₹{price:,}")
-                
-            except Exception as e:
-                logger.error(f"Error formatting record {idx}: {str(e)}")
-                continue
-
-        logger.info(f"Successfully formatted {len(formatted_data)} properties")
-        return formatted_data
+        worksheet = get_interactions_worksheet()
+        if not worksheet:
+            raise RuntimeError("Could not open UserInteractions worksheet")
+        result = sheets_call('append_rows', worksheet.append_rows, rows, idempotent=False)
+        logger.info(f"Appended {len(rows)} user interaction rows")
+    except Exception:
+        reset_sheet_handles()
+        raise
 
-    except Exception as e:
-        logger.error(f"Error in format_property_data: {str(e)}")
-        return {}
+    # Record where the rows landed, e.g. "UserInteractions!A5:H9"
+    match = _RANGE_START_RE.search(result.get('updates', {}).get('updatedRange', ''))
+    if not match:
+        return None
+    first_row = int(match.group(1))
+    latest = {}
+    for offset, row in enumerate(rows):
+        latest[row[PHONE_COL - 1]] = first_row + offset
+    _get_row_index().record(latest)
+    return first_row
 
-def store_user_interaction(user_data: Dict[str, Any]) -> bool:
-    """Store user interaction data in UserInteractions sheet"""
+def last_interaction_row() -> int:
+    """Highest UserInteractions row indexed on this host, 1 (the headers) if none"""
+    return _get_row_index().last_row()
+
+def find_interaction_rows(rows: List[List[Any]], start: int) -> List[bool]:
+    """Whether each row is already in the sheet at ``start`` or below, by timestamp and phone
+
+    Used before replaying an append whose earlier attempt failed in a way
+    that may still have written it.
+    """
     try:
-        client = get_sheets_client()
-        if not client:
-            logger.error("Could not initialize Google Sheets client")
+        worksheet = get_interactions_worksheet()
+        if not worksheet:
+            raise RuntimeError("Could not open UserInteractions worksheet")
+        values = sheets_call('find_rows', worksheet.get, f"A{start}:{PHONE_COLUMN}")
+    except Exception:
+        reset_sheet_handles()
+        raise
+    present = {tuple(cells[:PHONE_COL]) for cells in values if len(cells) >= PHONE_COL}
+    return [tuple(row[:PHONE_COL]) in present for row in rows]
+
+def interaction_rows(phone_numbers: Iterable[str]) -> Dict[str, int]:
+    """Latest UserInteractions row for each phone number that has one, raising on API failure
+
+    A local lookup in the host-wide index. The phone column is read again
+    when the index is new or ROW_INDEX_MAX_AGE old, or when a number is
+    missing and the column was last read ROW_INDEX_REBUILD_INTERVAL ago;
+    until then a missing number stays missing. Those reads also pick up rows
+    appended from other hosts.
+    """
+    phone_numbers = list(set(phone_numbers))
+    index = _get_row_index()
+    found = index.lookup(phone_numbers)
+    rebuilt_at = index.rebuilt_at()
+    age = time.time() - rebuilt_at if rebuilt_at is not None else None
+    stale = age is None or age >= ROW_INDEX_MAX_AGE or (
+        len(found) < len(phone_numbers) and age >= ROW_INDEX_REBUILD_INTERVAL)
+    if stale and index.claim_rebuild(rebuilt_at):
+        try:
+            worksheet = get_interactions_worksheet()
+            if not worksheet:
+                raise RuntimeError("Could not open UserInteractions worksheet")
+            _rebuild_row_index(worksheet)
+        except Exception:
+            index.release_rebuild(rebuilt_at)
+            reset_sheet_handles()
+            raise
+        found = index.lookup(phone_numbers)
+    return found
+
+def write_interaction_statuses(statuses: Dict[int, str]):
+    """Set the status of several UserInteractions rows in one API call, raising on failure"""
+    try:
+        worksheet = get_interactions_worksheet()
+        if not worksheet:
+            raise RuntimeError("Could not open UserInteractions worksheet")
+        sheets_call('batch_update', worksheet.batch_update, [
+            {'range': gspread.utils.rowcol_to_a1(row, STATUS_COL), 'values': [[status]]}
+            for row, status in statuses.items()
+        ])
+        logger.info(f"Updated status on {len(statuses)} user interaction rows")
+    except Exception:
+        reset_sheet_handles()
+        raise
+
+def write_interaction_status(phone_number: str, status: str) -> bool:
+    """Set the status on the latest row for a phone number, raising on API failure"""
+    try:
+        worksheet = get_interactions_worksheet()
+        if not worksheet:
+            raise RuntimeError("Could not open UserInteractions worksheet")
+
+        row = interaction_rows([phone_number]).get(phone_number)
+        if row is None:
+            logger.warning(f"No interaction found for phone number {phone_number}")
             return False
 
+        sheets_call('update_cell', worksheet.update_cell, row, STATUS_COL, status)
+        logger.info(f"Updated status to {status} for {phone_number}")
+        return True
+    except Exception:
+        reset_sheet_handles()
+        raise
+
+def store_user_interaction(user_data: Dict[str, Any]) -> bool:
+    """Store user interaction data in UserInteractions sheet"""
+    try:
         # Get spreadsheet ID from environment variable
-        sheet_id = os.getenv('GOOGLE_SHEET_ID')
-        if not sheet_id:
+        if not os.getenv('GOOGLE_SHEET_ID'):
             logger.error("No spreadsheet ID found in environment variables")
             return False
 
-        try:
-            spreadsheet = client.open_by_key(sheet_id)
-            
-            # Try to get the UserInteractions worksheet, create if it doesn't exist
-            try:
-                worksheet = spreadsheet.worksheet('UserInteractions')
-                logger.info("Found existing UserInteractions sheet")
-            except gspread.WorksheetNotFound:
-                worksheet = spreadsheet.add_worksheet('UserInteractions', 1000, 10)
-                # Add headers
-                headers = [
-                    'Timestamp',
-                    'Phone Number',
-                    'Property Type',
-                    'Budget',
-                    'Location',
-                    'Selected Property',
-                    'Visit Schedule',
-                    'Status'
-                ]
-                worksheet.append_row(headers)
-                logger.info("Created new UserInteractions sheet with headers")
-
-            # Prepare row data
-            row_data = [
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                user_data.get('phone_number', ''),
-                user_data.get('property_type', ''),
-                user_data.get('budget', ''),
-                user_data.get('location', ''),
-                user_data.get('selected_property', ''),
-                user_data.get('visit_schedule', ''),
-                user_data.get('status', 'Inquiry')
-            ]
-
-            # Append the data
-            worksheet.append_row(row_data)
-            logger.info(f"Successfully stored user interaction for {user_data.get('phone_number', 'unknown')}")
-            return True
-
-        except Exception as e:
-            logger.error(f"Error accessing or updating spreadsheet: {str(e)}")
-            return False
+        append_interaction_rows([build_interaction_row(user_data)])
+        logger.info(f"Successfully stored user interaction for {user_data.get('phone_number', 'unknown')}")
+        return True
 
     except Exception as e:
         logger.error(f"Error in store_user_interaction: {str(e)}")
@@ -226,34 +527,10 @@ def store_user_interaction(user_data: Dict[str, Any]) -> bool:
 def update_user_interaction_status(phone_number: str, status: str) -> bool:
     """Update the status of a user's interaction"""
     try:
-        client = get_sheets_client()
-        if not client:
-            return False
-
-        sheet_id = os.getenv('GOOGLE_SHEET_ID')
-        if not sheet_id:
+        if not os.getenv('GOOGLE_SHEET_ID'):
             return False
 
-        spreadsheet = client.open_by_key(sheet_id)
-        worksheet = spreadsheet.worksheet('UserInteractions')
-
-        # Find the latest row for this phone number
-        phone_col = 2  # Column B
-        status_col = 8  # Column H
-        
-        # Get all phone numbers
-        phone_numbers = worksheet.col_values(phone_col)
-        
-        # Find the last occurrence of this phone number
-        for idx in range(len(phone_numbers) - 1, 0, -1):
-            if phone_numbers[idx] == phone_number:
-                # Update status
-                worksheet.update_cell(idx + 1, status_col, status)
-                logger.info(f"Updated status to {status} for {phone_number}")
-                return True
-        
-        logger.warning(f"No interaction found for phone number {phone_number}")
-        return False
+        return write_interaction_status(phone_number, status)
 
     except Exception as e:
         logger.error(f"Error updating user interaction status: {str(e)}")
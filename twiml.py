@@ -0,0 +1,172 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, List, Sequence, Tuple
+
+from listings import Catalog, Property
+
+# Rendered result pages kept per catalog generation
+PAGE_CACHE_SIZE = 10000
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+
+
+def escape(text: str) -> str:
+    """Escape message text exactly as Twilio's TwiML element tree does"""
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def message(body: str = '', media: Iterable[str] = ()) -> str:
+    """Serialized ``<Message>`` element, ready to be added to a reply"""
+    inner = escape(body) + ''.join(f"<Media>{escape(url)}</Media>" for url in media)
+    return f"<Message>{inner}</Message>" if inner else '<Message />'
+
+
+class _Message:
+    """Handle for a message added with ``TwimlResponse.message``, to attach media"""
+
+    __slots__ = ('_response', '_index', '_body', '_media')
+
+    def __init__(self, response: 'TwimlResponse', index: int, body: str):
+        self._response = response
+        self._index = index
+        self._body = body
+        self._media: List[str] = []
+
+    def media(self, url: str) -> '_Message':
+        self._media.append(url)
+        self._response._parts[self._index] = message(self._body, self._media)
+        return self
+
+
+class TwimlResponse:
+    """Messaging reply assembled from pre-serialized fragments.
+
+    Produces the same XML as ``twilio.twiml.messaging_response.MessagingResponse``
+    for messages and media, without building an element tree per request.
+    Static prompts are serialized once at import with ``message()`` and added
+    with ``add``.
+    """
+
+    __slots__ = ('_parts',)
+
+    def __init__(self):
+        self._parts: List[str] = []
+
+    def message(self, body: str = '') -> _Message:
+        self._parts.append(message(body))
+        return _Message(self, len(self._parts) - 1, body)
+
+    def add(self, fragment: str):
+        """Append one or more serialized ``<Message>`` elements"""
+        self._parts.append(fragment)
+
+    def __str__(self) -> str:
+        if not self._parts:
+            return XML_HEADER + '<Response />'
+        return XML_HEADER + '<Response>' + ''.join(self._parts) + '</Response>'
+
+
+class RenderCache:
+    """Rendered listing fragments for one catalog generation.
+
+    Each ``CatalogState`` owns one, so a catalog refresh starts from an empty
+    cache and nothing rendered from an older catalog can be served.
+    """
+
+    def __init__(self, page_cache_size: int = PAGE_CACHE_SIZE):
+        self._lines = {}
+        self._cards = {}
+        self._pages: 'OrderedDict[Tuple, str]' = OrderedDict()
+        self._page_cache_size = page_cache_size
+        self._lock = threading.Lock()
+
+    def listing_line(self, listing: Property) -> str:
+        """Text of one listing in a results page, without its number"""
+        line = self._lines.get(listing.id)
+        if line is None:
+            line = self._lines[listing.id] = (
+                f"🏡 {listing.name}: ₹{listing.price:,} at {listing.location} ({listing.bhk} BHK)")
+        return line
+
+    def listing_card(self, listing: Property, max_images: int) -> str:
+        """Detail message for a listing followed by one message per image"""
+        card = self._cards.get(listing.id)
+        if card is None:
+            details = (f"Property: {listing.name}\nPrice: ₹{listing.price:,}\nLocation: {listing.location}\n"
+                       f"Description: {listing.description}")
+            images = listing.images[:max_images]
+            card = self._cards[listing.id] = message(details) + ''.join(
+                message("📸 Property Images:" if idx == 0 else '', [url])
+                for idx, url in enumerate(images))
+        return card
+
+    def results_page(self, properties: Catalog, results: Sequence[int], offset: int, page_size: int,
+                     footer: str, more_footer: str) -> str:
+        """A page of numbered results and its footer, as serialized messages"""
+        page = tuple(results[offset:offset + page_size])
+        remaining = len(results) - offset - page_size
+        key = (page, offset, remaining > 0 and remaining)
+        with self._lock:
+            fragment = self._pages.get(key)
+            if fragment is not None:
+                self._pages.move_to_end(key)
+                return fragment
+
+        lines = [f"{idx}. {self.listing_line(properties[prop_id])}"
+                 for idx, prop_id in enumerate(page, offset + 1) if prop_id in properties]
+        text = footer if remaining <= 0 else more_footer.format(remaining=remaining)
+        fragment = message("\n".join(lines)) + message(text)
+
+        with self._lock:
+            self._pages[key] = fragment
+            while len(self._pages) > self._page_cache_size:
+                self._pages.popitem(last=False)
+        return fragment
+
+
+if __name__ == "__main__":
+    # Equivalence with Twilio's builder, then rendering cost per reply
+    import time
+    from twilio.twiml.messaging_response import MessagingResponse
+
+    samples = ['plain', 'A & B <Towers> "quoted" \'single\'', '₹1,20,00,000 🏡\nnext line', '']
+    for body in samples:
+        ours, theirs = TwimlResponse(), MessagingResponse()
+        ours.message(body).media('https://e.com/a.jpg?x=1&y=2')
+        theirs.message(body).media('https://e.com/a.jpg?x=1&y=2')
+        ours.message(body)
+        theirs.message(body)
+        assert str(ours) == str(theirs), (str(ours), str(theirs))
+    assert str(TwimlResponse()) == str(MessagingResponse())
+
+    prompt = "Got it! Any preferred location?\n\nType 'back' to change budget\nType 'start' to begin again"
+    compiled = message(prompt)
+    rounds = 20000
+
+    def twilio_builder():
+        response = MessagingResponse()
+        response.message(prompt)
+        return str(response)
+
+    def fragment_builder():
+        response = TwimlResponse()
+        response.message(prompt)
+        return str(response)
+
+    def precompiled():
+        response = TwimlResponse()
+        response.add(compiled)
+        return str(response)
+
+    for label, render in (('MessagingResponse', twilio_builder), ('TwimlResponse.message', fragment_builder),
+                          ('precompiled prompt', precompiled)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            render()
+        print(f"{label:24s} {(time.perf_counter() - started) / rounds * 1e6:6.1f} us per reply")